@@ -0,0 +1,71 @@
+"""
+Benchmark the time it takes to generate the JavaScript code for long timelines.
+
+Run with `python benchmarks/bench_codegen.py`. The time per trial should stay
+roughly constant as the number of trials grows (linear scaling).
+"""
+
+import time
+
+from sweetbean import Block, Experiment
+from sweetbean.stimulus import Fixation, Text
+from sweetbean.variable import TimelineVariable
+
+SIZES = [1250, 2500, 5000, 10000]
+
+
+def time_stimuli(n_trials):
+    """
+    One block with `n_trials` stimuli
+    """
+    stimuli = [Text(duration=500, text=f"trial {i}") for i in range(n_trials)]
+    experiment = Experiment([Block(stimuli)])
+    start = time.perf_counter()
+    experiment.to_js()
+    return time.perf_counter() - start, len(experiment.js)
+
+
+def time_blocks(n_trials):
+    """
+    `n_trials` blocks with a fixation and a text each
+    """
+    blocks = [
+        Block([Fixation(500), Text(duration=500, text=f"trial {i}")])
+        for i in range(n_trials)
+    ]
+    experiment = Experiment(blocks)
+    start = time.perf_counter()
+    experiment.to_js()
+    return time.perf_counter() - start, len(experiment.js)
+
+
+def time_timeline(n_trials):
+    """
+    One block with a timeline of `n_trials` rows
+    """
+    timeline = [{"word": f"word {i}", "color": "red"} for i in range(n_trials)]
+    text = Text(text=TimelineVariable("word"), color=TimelineVariable("color"))
+    experiment = Experiment([Block([Fixation(500), text], timeline)])
+    start = time.perf_counter()
+    experiment.to_js()
+    return time.perf_counter() - start, len(experiment.js)
+
+
+def main():
+    # compile the functions once so the benchmark measures code generation only
+    Experiment([Block([Fixation(500), Text(text="warm up")])]).to_js()
+    for name, bench in [
+        ("stimuli", time_stimuli),
+        ("blocks", time_blocks),
+        ("timeline", time_timeline),
+    ]:
+        for n_trials in SIZES:
+            seconds, n_chars = bench(n_trials)
+            print(
+                f"{name:>8} {n_trials:>6} trials: {seconds:8.3f}s "
+                f"({seconds / n_trials * 1e6:7.1f}us/trial, {n_chars} chars)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark the time it takes to render the prompts of trials in language mode.
+
+Run with `python benchmarks/bench_language.py`. Rendering with the precompiled
+templates should be about two orders of magnitude faster than re-compiling the
+templates with `jinja2.Template` on every trial.
+"""
+
+import time
+
+from jinja2 import Template
+
+from sweetbean import Block, Experiment
+from sweetbean.stimulus import Text
+from sweetbean.variable import TimelineVariable
+
+SIZES = [1000, 2000, 4000]
+
+
+def _prepared_text():
+    text = Text(text="RED", color="red", choices=["f", "j"])
+    text._prepare_args_l({}, [], {})
+    return text
+
+
+def time_render(n_trials):
+    """
+    Render the prompt of a prepared stimulus `n_trials` times
+    """
+    text = _prepared_text()
+    start = time.perf_counter()
+    for _ in range(n_trials):
+        text._get_prompt_l()
+        text._get_response_prompt_l()
+    return time.perf_counter() - start
+
+
+def time_render_uncompiled(n_trials):
+    """
+    Like `time_render`, but compile the templates on every trial
+    """
+    text = _prepared_text()
+    choices = {"choices": [c.upper() for c in text.l_args["choices"]]}
+    start = time.perf_counter()
+    for _ in range(n_trials):
+        Template(text.l_template).render(text.l_args)
+        Template(text.response_template).render(choices)
+    return time.perf_counter() - start
+
+
+def time_run(n_trials):
+    """
+    Run one block with a timeline of `n_trials` rows on language
+    """
+    timeline = [{"word": f"word {i}"} for i in range(n_trials)]
+    text = Text(text=TimelineVariable("word"), choices=["f", "j"])
+    experiment = Experiment([Block([text], timeline)])
+    start = time.perf_counter()
+    experiment.run_on_language(lambda prompt: "f")
+    return time.perf_counter() - start
+
+
+def main():
+    for name, bench in [
+        ("render", time_render),
+        ("uncompiled", time_render_uncompiled),
+        ("run", time_run),
+    ]:
+        for n_trials in SIZES:
+            seconds = bench(n_trials)
+            print(
+                f"{name:>10} {n_trials:>6} trials: {seconds:8.3f}s "
+                f"({seconds / n_trials * 1e6:7.1f}us/trial)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,50 @@ HTML_PREAMBLE = (
 )
 HTML_APPENDIX = "</script>\n</html>"
 
+# rebuilds the rows of a columnar timeline (see `Block`) when jsPsych accesses them
+TIMELINE_COLUMNS_FUNCTION = "sweetbeanTimelineColumns"
+TIMELINE_COLUMNS_JS = (
+    f"function {TIMELINE_COLUMNS_FUNCTION}(columns){{"
+    "const keys=Object.keys(columns);"
+    "const length=keys.length?columns[keys[0]].length:0;"
+    "const isRow=(prop)=>typeof prop==='string'&&/^\\d+$/.test(prop)&&+prop<length;"
+    "return new Proxy(new Array(length),{"
+    "has(rows,prop){return isRow(prop)||Reflect.has(rows,prop);},"
+    "get(rows,prop,receiver){if(isRow(prop)&&!(prop in rows)){"
+    "const row={};for(const key of keys){row[key]=columns[key][+prop];}rows[prop]=row;}"
+    "return Reflect.get(rows,prop,receiver);}});}\n"
+)
+
+# loads a timeline file (see `Experiment.write_timeline_files`), gzip-compressed
+# files are decompressed unless the server already did so
+TIMELINE_FETCH_FUNCTION = "sweetbeanFetchTimeline"
+TIMELINE_FETCH_JS = (
+    f"function {TIMELINE_FETCH_FUNCTION}(url){{"
+    "return fetch(url).then((response)=>{"
+    "if(!response.ok){throw new Error(`Could not load ${url}`);}"
+    "return response.arrayBuffer();}).then((buffer)=>{"
+    "const bytes=new Uint8Array(buffer);"
+    "if(bytes[0]===0x1f&&bytes[1]===0x8b){"
+    "return new Response(new Blob([bytes]).stream()"
+    ".pipeThrough(new DecompressionStream('gzip'))).text();}"
+    "return new TextDecoder().decode(bytes);}).then(JSON.parse);}\n"
+)
+
+# set on the window once a trial rendered for an image has been drawn (awaited by
+# `HtmlRenderer` before the screenshot is taken)
+IMAGE_READY_FLAG = "__sweetbeanReady"
+
+
+def IMAGE_READY_WRAPPER(trial_js):
+    return (
+        "((trial)=>{const onLoad=trial.on_load;trial.on_load=(...args)=>{"
+        "if(onLoad){onLoad(...args);}"
+        "Promise.all([document.fonts.ready,"
+        "...Array.from(document.images,(img)=>img.decode().catch(()=>{}))])"
+        ".then(()=>requestAnimationFrame(()=>requestAnimationFrame(()=>{"
+        f"window.{IMAGE_READY_FLAG}=true;}})))}};return trial;}})({trial_js})"
+    )
+
 
 JSPSYCH = {"jspsych": "7.3.1"}
 
@@ -43,7 +87,7 @@ DEPENDENCIES = {
     "jsPsychSurveyText": {"@jspsych/plugin-survey-text": "1.1.2"},
     "jsPsychSurveyMultiChoice": {"@jspsych/plugin-survey-multi-choice": "1.1.2"},
     "jsPsychSurveyLikert": {"@jspsych/plugin-survey-likert": "1.1.2"},
-    "jsPsychRok": {"'@jspsych-contrib/plugin-rok": "1.1.1"},
+    "jsPsychRok": {"@jspsych-contrib/plugin-rok": "1.1.1"},
     "jsPsychImageKeyboardResponse": {
         "@jspsych/plugin-image-keyboard-response": "1.1.2"
     },
@@ -51,12 +95,27 @@ DEPENDENCIES = {
         "@jspsych/plugin-video-keyboard-response": "1.1.2"
     },
     "jsPsychHtmlChoice": {"@jspsych-contrib/plugin-html-choice": "1.0.0"},
-    "jsPsychRSVP": {"@sweet-jspsych/plugin-rsvp": "0.2.4"},
+    "jsPsychRsvp": {"@sweet-jspsych/plugin-rsvp": "0.2.5"},
+    "jsPsychBilateralRsvp": {"@sweet-jspsych/plugin-rsvp": "0.2.5"},
     "jsPsychSymbol": {"@sweet-jspsych/plugin-symbol": "0.4.6"},
     "jsPsychForaging": {"@sweet-jspsych/plugin-foraging": "0.2.1"},
     "jsPsychGaborArray": {"@sweet-jspsych/plugin-gabor-array": "0.1.1"},
 }
 
+SWEETBEAN_RUNTIME = {"sweetbean": "0.0.6"}
+
+CDN = "https://unpkg.com"
+PACKAGE_CDNS = {"sweetbean": "https://cdn.jsdelivr.net/npm"}
+
+# the files of the packages that are loaded in the browser (packages that are not
+# listed here load `DEFAULT_SCRIPT`), paths are relative to the package root as
+# on unpkg.com or cdn.jsdelivr.net/npm
+DEFAULT_SCRIPT = "dist/index.browser.min.js"
+SCRIPTS = {"sweetbean": "dist/runtime-script.js"}
+STYLESHEETS = {"jspsych": ["css/jspsych.css"], "sweetbean": ["dist/style/main.css"]}
+# stylesheets that are only needed by some plugins
+TYPE_STYLESHEETS = {"jsPsychHtmlChoice": {"sweetbean": ["dist/style/bandit.css"]}}
+
 AUTORA_PREAMBLE = (
     "import 'jspsych/css/jspsych.css'\nconst main = async (id, condition) => {\n"
     "const jsPsych = initJsPsych()\n"
@@ -1,13 +1,20 @@
 import asyncio
 import io
+import itertools
+import json
 import math
+import os
 import random
+import shutil
+import subprocess
+import tempfile
 from typing import Any, Dict, List
 
 from PIL import Image, ImageDraw, ImageFont
-from pyppeteer import launch
 
-from sweetbean._const import HTML_APPENDIX, HTML_PREAMBLE
+from sweetbean._const import HTML_APPENDIX, HTML_PREAMBLE, TIMELINE_COLUMNS_FUNCTION
+from sweetbean.util.emit import write_joined
+from sweetbean.util.render import HtmlRenderer
 from sweetbean.variable import CodeVariable
 
 
@@ -21,31 +28,129 @@ class Block:
     timeline = None
     extensions: Dict = {}
 
-    def __init__(self, stimuli, timeline=None):
+    def __init__(self, stimuli, timeline=None, columnar_timeline=False):
         """
         Arguments:
             stimuli: a list of stimuli
             timeline: a list of dictionaries with the name of the timeline variables
+            columnar_timeline: if True, the timeline is written as one array per
+                timeline variable instead of one object per row (the rows are
+                rebuilt in the browser when they are accessed). This only applies
+                if all rows have the same keys.
         """
         if timeline is None:
             timeline = []
         self.stimuli = stimuli
         self.timeline = timeline
-        self.extensions["touch_layouts"] = []
+        self.columnar_timeline = columnar_timeline
+        self.extensions = {"touch_layouts": []}
 
-    def to_js(self):
-        self.js = "{timeline: ["
+    def to_js(self, shared_stimuli=None):
+        """
+        Generate the JavaScript code of the block (stored in `self.js`)
+
+        Arguments:
+            shared_stimuli: a mapping from the code of a stimulus to the name of a
+                shared definition that is referenced instead of the code
+        """
+        self._set_touch_layouts()
+        self._set_js(shared_stimuli)
+
+    def _set_js(self, shared_stimuli=None, timeline_name=None):
+        out = io.StringIO()
+        self._write_js(out, shared_stimuli, timeline_name)
+        self.js = out.getvalue()
+
+    def write_js(self, out):
+        """
+        Write the JavaScript code of the block to a text stream
+        """
+        self._set_touch_layouts()
+        self._write_js(out)
+
+    def _set_touch_layouts(self):
+        self.extensions["touch_layouts"] = [
+            s.create_touch_layout() for s in self.stimuli
+        ]
+
+    def _write_js(self, out, shared_stimuli=None, timeline_name=None):
+        out.write("{timeline: [")
+        write_joined(out, self._stimuli_js(shared_stimuli))
+        out.write("], timeline_variables: ")
+        if timeline_name is None:
+            self._write_timeline(out)
+        elif self._timeline_columns():
+            out.write(f"{TIMELINE_COLUMNS_FUNCTION}({timeline_name})")
+        else:
+            out.write(timeline_name)
+        out.write("}")
+
+    def _stimuli_js(self, shared_stimuli=None):
         for s in self.stimuli:
-            self.extensions["touch_layouts"].append(s.create_touch_layout())
             s.to_js()
-            self.js += s.js + ","
-        self.js = self.js[:-1]
+            if shared_stimuli and s.js in shared_stimuli:
+                yield shared_stimuli[s.js]
+            else:
+                yield s.js
+
+    def _write_timeline(self, out):
         if isinstance(self.timeline, CodeVariable):
-            self.js += f"], timeline_variables: {self.timeline.name}" + "}"
+            out.write(self.timeline.name)
+        elif self._timeline_columns():
+            out.write(f"{TIMELINE_COLUMNS_FUNCTION}({{")
+            write_joined(out, self._timeline_columns_js())
+            out.write("})")
+        elif isinstance(self.timeline, list):
+            # same as str(self.timeline) but written row by row
+            out.write("[")
+            write_joined(out, (repr(row) for row in self.timeline), ", ")
+            out.write("]")
         else:
-            self.js += f"], timeline_variables: {self.timeline}" + "}"
+            out.write(f"{self.timeline}")
 
-    def to_image(self, path, data, sequence=True, timeline_idx="random", zoom_factor=3):
+    def write_timeline_json(self, out):
+        """
+        Write the timeline as JSON to a text stream (as columns if
+        `columnar_timeline` applies)
+        """
+        if self._timeline_columns():
+            out.write("{")
+            write_joined(out, self._timeline_columns_js())
+            out.write("}")
+        else:
+            out.write("[")
+            write_joined(out, (json.dumps(row) for row in self.timeline))
+            out.write("]")
+
+    def _timeline_columns(self):
+        """
+        Return the keys of the timeline rows if the timeline is written as columns
+        """
+        if not (
+            self.columnar_timeline and isinstance(self.timeline, list) and self.timeline
+        ):
+            return None
+        keys = list(self.timeline[0])
+        key_set = set(keys)
+        if any(set(row) != key_set for row in self.timeline):
+            return None
+        return keys
+
+    def _timeline_columns_js(self):
+        for key in self._timeline_columns():
+            column = (json.dumps(row[key]) for row in self.timeline)
+            yield f"{json.dumps(key)}:[{','.join(column)}]"
+
+    def to_image(
+        self,
+        path,
+        data,
+        sequence=True,
+        timeline_idx="random",
+        zoom_factor=3,
+        concurrency=1,
+        max_size=None,
+    ):
         """
         Create an image of the stimuli sequence of the block
         Arguments:
@@ -58,9 +163,165 @@ class Block:
                 timeline element is chosen, if none, the whole timeline is shown
             zoom_factor: the factor by which the images are zoomed (can be a list if
                 different zoom factors for each stimulus are needed)
+            concurrency: the number of pages that render at the same time
+            max_size: the maximum width and height of the combined image in pixels
+
+        A browser is started and closed for this call. To share one browser
+        between calls, use `to_image_async` with an `HtmlRenderer`.
+        """
+        return asyncio.run(
+            self.to_image_async(
+                path,
+                data,
+                sequence,
+                timeline_idx,
+                zoom_factor,
+                concurrency=concurrency,
+                max_size=max_size,
+            )
+        )
+
+    async def to_image_async(
+        self,
+        path,
+        data,
+        sequence=True,
+        timeline_idx="random",
+        zoom_factor=3,
+        renderer=None,
+        concurrency=1,
+        max_size=None,
+    ):
+        """
+        Create an image of the stimuli sequence of the block (see `to_image`) from
+        within a running event loop
+
+        All stimuli are rendered in one browser, `concurrency` pages at a time. Pass
+        an `HtmlRenderer` as `renderer` to share the browser with other calls (a
+        shared renderer needs at least `concurrency` as `max_pages`); the caller
+        closes it. If the images are stored separately, each one is saved as soon
+        as it is rendered.
+        """
+        if renderer is None:
+            async with HtmlRenderer(max_pages=concurrency) as renderer:
+                return await self.to_image_async(
+                    path,
+                    data,
+                    sequence,
+                    timeline_idx,
+                    zoom_factor,
+                    renderer,
+                    concurrency,
+                    max_size,
+                )
+
+        documents, durations = self._image_documents(data, timeline_idx)
+        image_dir = path if not sequence else None
+        images = await _render_images(documents, renderer, concurrency, image_dir)
+        if not sequence:
+            if path:
+                return
+            return images, durations
+        result_image = create_stimulus_sequence(
+            images, durations, zoom_factor=zoom_factor, max_size=max_size
+        )
+        if path:
+            result_image.save(path)
+            return
+        return result_image
 
+    def to_animation(
+        self,
+        path,
+        data=None,
+        timeline_idx="random",
+        concurrency=1,
+        max_size=None,
+        response_duration=1000,
+        loop=0,
+    ):
         """
+        Save the stimuli sequence of the block as an animation in which every
+        stimulus is shown for its duration
+        Arguments:
+            path: the path of the animation (.webp, .gif or .mp4, which requires
+                ffmpeg on the PATH)
+            data: if needed data can be passed in for the stimuli
+                (for example, correct if the sequence contains a feedback stimulus)
+            timeline_idx: the index of the timeline element to use, if "random" a random
+                timeline element is chosen, if none, the whole timeline is shown
+            concurrency: the number of pages that render at the same time
+            max_size: the maximum width and height of the frames in pixels
+            response_duration: the number of milliseconds to show stimuli that are
+                shown until a response is given
+            loop: the number of times the animation is repeated (0 repeats forever,
+                not used for .mp4)
+
+        A browser is started and closed for this call. To share one browser
+        between calls, use `to_animation_async` with an `HtmlRenderer`.
+        """
+        return asyncio.run(
+            self.to_animation_async(
+                path,
+                data,
+                timeline_idx,
+                concurrency=concurrency,
+                max_size=max_size,
+                response_duration=response_duration,
+                loop=loop,
+            )
+        )
+
+    async def to_animation_async(
+        self,
+        path,
+        data=None,
+        timeline_idx="random",
+        renderer=None,
+        concurrency=1,
+        max_size=None,
+        response_duration=1000,
+        loop=0,
+    ):
+        """
+        Save the stimuli sequence of the block as an animation (see `to_animation`)
+        from within a running event loop
 
+        Pass an `HtmlRenderer` as `renderer` to share the browser with other calls
+        (the caller closes it). The frames are rendered to a temporary directory
+        before the animation is encoded (see `save_animation` for the memory use
+        of each format).
+        """
+        if renderer is None:
+            async with HtmlRenderer(max_pages=concurrency) as renderer:
+                return await self.to_animation_async(
+                    path,
+                    data,
+                    timeline_idx,
+                    renderer,
+                    concurrency,
+                    max_size,
+                    response_duration,
+                    loop,
+                )
+
+        documents, durations = self._image_documents(data, timeline_idx)
+        durations = [response_duration if d is None else d for d in durations]
+        with tempfile.TemporaryDirectory() as directory:
+            await _render_images(documents, renderer, concurrency, directory)
+            frames = [
+                os.path.join(directory, f"stimulus_{idx}.png")
+                for idx in range(len(documents))
+            ]
+            await asyncio.get_running_loop().run_in_executor(
+                None, save_animation, frames, durations, path, max_size, loop
+            )
+
+    def _image_documents(self, data, timeline_idx):
+        """
+        Return the HTML documents that show the stimuli of the block one by one and
+        the durations of the stimuli
+        """
         data_in = []
         shared_variables = {}
         for s in self.stimuli:
@@ -77,8 +338,10 @@ class Block:
         elif timeline_idx is not None:
             timeline = [timeline[timeline_idx]]
 
+        # the documents are prepared in order because the data of earlier stimuli
+        # can be used by later ones
         k = 0
-        images = []
+        documents = []
         durations = []
         for t in timeline:
             for s in self.stimuli:
@@ -93,80 +356,166 @@ class Block:
                 html += "];\n"
                 html += "jsPsych.run(trials);"
                 html += HTML_APPENDIX
-                image = asyncio.run(render_html_to_image(html))
                 duration = s.l_args["duration"] if "duration" in s.l_args else 0
-                images.append(image)
+                documents.append(html)
                 durations.append(duration)
                 if data and k < len(data):
                     data_in.append(data[k])
                 k += 1
 
-        if not sequence:
-            if path:
-                for idx, i in enumerate(images):
-                    i.save(f"{path}/stimulus_{idx}.png")
-                return
-            return images, durations
-        result_image = create_stimulus_sequence(
-            images, durations, zoom_factor=zoom_factor
-        )
-        if path:
-            result_image.save(path)
-            return
-        return result_image
+        return documents, durations
 
 
-async def render_html_to_image(html_content):
-    # Launch headless browser
-    browser = await launch(
-        headless=True, args=["--no-sandbox", "--disable-setuid-sandbox"]
+async def _render_images(documents, renderer, concurrency, directory=None):
+    """
+    Render HTML documents on up to `concurrency` pages at a time and return the
+    images in the order of the documents (if `directory` is set, the images are
+    saved there as soon as they are rendered and not returned)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _render(idx, html):
+        async with semaphore:
+            image = await renderer.render(html)
+        if directory:
+            await asyncio.get_running_loop().run_in_executor(
+                None, image.save, os.path.join(directory, f"stimulus_{idx}.png")
+            )
+            return None
+        return image
+
+    return await asyncio.gather(
+        *(_render(idx, html) for idx, html in enumerate(documents))
     )
-    page = await browser.newPage()
 
-    await page.setViewport({"width": 1920, "height": 1080})
 
-    # Set the HTML content directly
-    await page.setContent(html_content)
-
-    # Wait for JavaScript to execute
-    await asyncio.sleep(5)
-
-    # Take a screenshot and store it in memory
-    screenshot_bytes = await page.screenshot({"fullPage": False})
+def save_animation(frames, durations, path, max_size=None, loop=0):
+    """
+    Encode frames into an animation in which every frame is shown for its duration
+
+    An .mp4 is encoded by ffmpeg, which reads the frames from disk one at a time
+    (frames given as images are written to temporary files first). Pillow encodes
+    .webp and .gif and keeps all frames in memory until the file is written, so
+    use .mp4 for long sequences of large frames.
+
+    Arguments:
+        frames: the frames as images or paths of image files
+        durations: the durations of the frames in milliseconds
+        path: the path of the animation (.webp, .gif or .mp4, which requires ffmpeg
+            on the PATH)
+        max_size: the maximum width and height of the frames in pixels
+        loop: the number of times the animation is repeated (0 repeats forever, not
+            used for .mp4)
+    """
+    frames = list(frames)
+    durations = [int(d) for d in durations]
+    if len(frames) != len(durations):
+        raise ValueError("The number of frames and durations must be the same.")
+    if not frames:
+        raise ValueError("An animation needs at least one frame.")
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".mp4":
+        _save_mp4(frames, durations, path, max_size)
+    elif extension in (".webp", ".gif"):
+        images = (_load_frame(frame, max_size) for frame in frames)
+        first = next(images)
+        first.save(
+            path,
+            save_all=True,
+            append_images=images,
+            duration=durations,
+            loop=loop,
+        )
+    else:
+        raise ValueError(
+            f"Unknown animation format: {extension}. "
+            "Only .webp, .gif or .mp4 are supported."
+        )
 
-    # Close the browser
-    await browser.close()
 
-    # Create an Image object using PIL
-    image = Image.open(io.BytesIO(screenshot_bytes))
+def _load_frame(frame, max_size=None):
+    if not isinstance(frame, Image.Image):
+        with Image.open(frame) as f:
+            frame = f.convert("RGB")
+    if max_size is not None and max(frame.size) > max_size:
+        frame = frame.copy()
+        frame.thumbnail((max_size, max_size), Image.LANCZOS)
+    return frame
+
+
+def _save_mp4(frames, durations, path, max_size=None):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("Saving an animation as .mp4 requires ffmpeg on the PATH.")
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for idx, frame in enumerate(frames):
+            if isinstance(frame, Image.Image):
+                file = os.path.join(directory, f"frame_{idx}.png")
+                frame.save(file)
+                frame = file
+            files.append(os.path.abspath(frame).replace("'", "'\\''"))
+        # the concat demuxer reads the frames from disk one at a time, the last
+        # file is repeated so that its duration is applied
+        playlist = os.path.join(directory, "frames.txt")
+        with open(playlist, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for file, duration in zip(files, durations):
+                f.write(f"file '{file}'\nduration {duration / 1000}\n")
+            f.write(f"file '{files[-1]}'\n")
+        scale = "trunc(iw/2)*2:trunc(ih/2)*2"
+        if max_size is not None:
+            scale = (
+                f"w='min(iw,{max_size})':h='min(ih,{max_size})'"
+                ":force_original_aspect_ratio=decrease,scale=" + scale
+            )
+        subprocess.run(
+            [
+                ffmpeg,
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                playlist,
+                "-vf",
+                f"scale={scale}",
+                "-pix_fmt",
+                "yuv420p",
+                "-r",
+                "30",
+                path,
+            ],
+            check=True,
+        )
 
-    return image
 
+async def render_html_to_image(html_content, renderer=None):
+    """
+    Render an HTML document to a PIL image
 
-def create_stimulus_sequence(
-    images,
-    timings,
-    overlap_x=0.05,
-    overlap_y=0.5,
-    zoom_factor=2.5,
-    arrow_color=(0, 0, 0),
-    font_path=None,
-):
-    if not hasattr(zoom_factor, "__iter__"):
-        zoom_factor = [zoom_factor] * len(images)
-    if len(images) != len(timings):
-        raise ValueError("The number of images and timings must be the same.")
+    Arguments:
+        html_content: the HTML document
+        renderer: an `HtmlRenderer` to reuse (by default, a browser is started and
+            closed for this call)
+    """
+    if renderer is not None:
+        return await renderer.render(html_content)
+    async with HtmlRenderer() as renderer:
+        return await renderer.render(html_content)
 
-    # Determine the size of each image (assuming all images are the same size)
-    img_width, img_height = images[0].size
 
+def _sequence_layout(count, img_width, img_height, overlap_x, overlap_y):
     # Calculate overlap in pixels
     x_overlap = img_width * overlap_x
     y_overlap = img_height * overlap_y
 
     # Calculate positions for each image
     positions = []
-    for idx in range(len(images)):
+    for idx in range(count):
         x = int(idx * (img_width - x_overlap)) + int(
             img_width * 0.25
         )  # Extra space for arrow and text
@@ -183,12 +532,63 @@ def create_stimulus_sequence(
     total_height = (
         last_y + img_height + int(img_height * 0.5)
     )  # Extra space for arrow and text
+    return positions, (total_width, total_height)
+
+
+def create_stimulus_sequence(
+    images,
+    timings,
+    overlap_x=0.05,
+    overlap_y=0.5,
+    zoom_factor=2.5,
+    arrow_color=(0, 0, 0),
+    font_path=None,
+    max_size=None,
+):
+    """
+    Combine the images of a stimulus sequence into one staircase image with the
+    timings along an arrow
+
+    The layout is computed up front and every image is cropped, zoomed and
+    downsampled to its final size in one step before it is pasted, so only the
+    output image (and one input image at a time) is held in memory.
+
+    Arguments:
+        images: the images of the stimuli (all of the same size, can be an iterator)
+        timings: the durations of the stimuli
+        overlap_x: the horizontal overlap of consecutive images
+        overlap_y: the vertical overlap of consecutive images
+        zoom_factor: the factor by which the images are zoomed (can be a list)
+        arrow_color: the color of the arrow
+        font_path: the path of a TrueType font for the timings
+        max_size: the maximum width and height of the output image in pixels
+    """
+    count = len(timings)
+    if not hasattr(zoom_factor, "__iter__"):
+        zoom_factor = [zoom_factor] * count
+    if hasattr(images, "__len__") and len(images) != count:
+        raise ValueError("The number of images and timings must be the same.")
+    images = iter(images)
+    first = next(images)
+
+    # Determine the size of each image (assuming all images are the same size)
+    width, height = first.size
+    positions, total_size = _sequence_layout(count, width, height, overlap_x, overlap_y)
+    scale = 1
+    if max_size is not None and max(total_size) > max_size:
+        scale = max_size / max(total_size)
+    img_width = max(1, round(width * scale))
+    img_height = max(1, round(height * scale))
+    if scale != 1:
+        positions, total_size = _sequence_layout(
+            count, img_width, img_height, overlap_x, overlap_y
+        )
 
-    font_size = int(images[0].size[0] * 0.1)  # 10% of the image height
+    font_size = int(img_width * 0.1)  # 10% of the image height
     font_size = max(10, font_size)
 
     # Create a new image with white background
-    canvas = Image.new("RGB", (total_width, total_height), "white")
+    canvas = Image.new("RGB", total_size, "white")
     draw = ImageDraw.Draw(canvas)
 
     # Optional: Load a custom font
@@ -197,28 +597,29 @@ def create_stimulus_sequence(
     else:
         font = ImageFont.load_default(size=font_size)
 
-    zoom_idx = 0
     # Paste images onto the canvas
-    for img, (x, y) in zip(images, positions):
-        # Calculate new dimensions for zooming
-        width, height = img.size
-        crop_width = int(width / zoom_factor[zoom_idx])
-        crop_height = int(height / zoom_factor[zoom_idx])
-        zoom_idx += 1
-
+    pasted = 0
+    # (the positions come first so that a surplus image is not consumed)
+    for (x, y), zoom, img in zip(
+        positions, zoom_factor, itertools.chain([first], images)
+    ):
         # Define the cropping box around the center
+        crop_width = int(width / zoom)
+        crop_height = int(height / zoom)
         left = (width - crop_width) // 2
         upper = (height - crop_height) // 2
-        right = left + crop_width
-        lower = upper + crop_height
+        box = (left, upper, left + crop_width, upper + crop_height)
 
-        # Crop and resize the image back to its original size
-        cropped_img = img.crop((left, upper, right, lower)).resize(
-            (width, height), Image.LANCZOS
+        # Crop and resize the image to its size on the canvas
+        zoomed_img = img.resize(
+            (img_width, img_height), Image.LANCZOS, box=box, reducing_gap=3.0
         )
 
         # Paste the zoomed image onto the canvas
-        canvas.paste(cropped_img, (x, y), cropped_img if img.mode == "RGBA" else None)
+        canvas.paste(zoomed_img, (x, y), zoomed_img if img.mode == "RGBA" else None)
+        pasted += 1
+    if pasted != count or next(images, None) is not None:
+        raise ValueError("The number of images and timings must be the same.")
 
     # Draw a diagonal arrow below the images
     arrow_start = (positions[0][0], positions[0][1] + img_height)
@@ -1,13 +1,41 @@
+import copy
+import gzip
+import io
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from sweetbean._const import (
     FUNCTION_APPENDIX,
     FUNCTION_PREAMBLE,
     HTML_APPENDIX,
-    HTML_PREAMBLE,
     TEXT_APPENDIX,
+    TIMELINE_COLUMNS_JS,
+    TIMELINE_FETCH_FUNCTION,
+    TIMELINE_FETCH_JS,
 )
 from sweetbean.block import Block
+from sweetbean.stimulus.Stimulus import _BaseStimulus
+from sweetbean.util.aio import (
+    BackgroundLoop,
+    arun_steps,
+    run_steps,
+    run_steps_batch,
+    steps_from_callable,
+    sync_callable,
+)
+from sweetbean.util.bundle import write_bundle_preamble, write_preamble
+from sweetbean.util.cache import cache_key
+from sweetbean.util.checkpoint import (
+    CheckpointWriter,
+    LanguageCheckpoint,
+    check_serializable,
+    load_checkpoint,
+)
+from sweetbean.util.history import PromptHistory
+from sweetbean.util.parse import _compile_fcts
 
 
 class Experiment:
@@ -25,87 +53,342 @@ class Experiment:
         """
         self.blocks = blocks
 
-    def to_js(self, path_local_download=None):
-        self.js = ""
+    def to_js(
+        self,
+        path_local_download=None,
+        workers=None,
+        deduplicate=False,
+        timeline_urls=None,
+    ):
+        """
+        Generate the JavaScript code of the experiment (stored in `self.js`)
+
+        Arguments:
+            path_local_download: if set, the data is saved locally (.json or .csv)
+                at the end of the experiment
+            workers: the number of Transcrypt compilations to run in parallel
+            deduplicate: if True, stimuli that generate identical code are defined
+                once as shared constants and referenced by name
+            timeline_urls: a mapping from the index of a block to the URL of a JSON
+                file with its timeline (see `write_timeline_files`). These timelines
+                are fetched before the experiment starts instead of being inlined.
+        """
+        out = io.StringIO()
+        self.write_js(out, path_local_download, workers, deduplicate, timeline_urls)
+        self.js = out.getvalue()
+
+    def write_js(
+        self,
+        out,
+        path_local_download=None,
+        workers=None,
+        deduplicate=False,
+        timeline_urls=None,
+    ):
+        """
+        Write the JavaScript code of the experiment to a text stream.
+
+        Blocks, stimuli and timeline rows are written as soon as they are
+        generated, so the full program is never held in memory (`self.js` and
+        the `js` attributes of the blocks are not set). With `deduplicate`, the
+        code of every distinct stimulus is kept in memory until the shared
+        definitions are written, since they have to precede the blocks.
+
+        Arguments:
+            out: a text stream (for example, an open file)
+            path_local_download: if set, the data is saved locally (.json or .csv)
+                at the end of the experiment
+            workers: the number of Transcrypt compilations to run in parallel
+            deduplicate: if True, stimuli that generate identical code are defined
+                once as shared constants and referenced by name
+            timeline_urls: a mapping from the index of a block to the URL of a JSON
+                file with its timeline (see `write_timeline_files`). These timelines
+                are fetched before the experiment starts instead of being inlined.
+        """
+        timeline_urls = timeline_urls or {}
+        shared_variables, extensions, shared_stimuli = self._prepare_js(
+            workers, deduplicate
+        )
+        self._write_header(out, shared_variables, extensions, path_local_download)
+        self._write_definitions(out, shared_stimuli, timeline_urls)
+        _write_timeline_fetch(out, timeline_urls)
+        out.write("trials = [\n")
+        self._write_blocks(out, shared_stimuli, timeline_urls)
+        out.write("]\n")
+        out.write(";jsPsych.run(trials)")
+        if timeline_urls:
+            out.write("})")
+
+    def _prepare_js(self, workers=None, deduplicate=False):
+        """
+        Compile the functions, set the touch layouts of the blocks and return the
+        shared variables, the extensions and the shared stimuli (see
+        `_shared_stimuli`)
+        """
+        self._compile_functions(workers)
         shared_variables = {}
-        extensions = ""
+        touch_layouts = []
         for b in self.blocks:
-            b.to_js()
-            extensions += _initialize_extensions(b.extensions)
+            b._set_touch_layouts()
+            touch_layouts += b.extensions["touch_layouts"]
             for s in b.stimuli:
                 shared_variables.update(s.return_shared_variables())
+        shared_stimuli = self._shared_stimuli() if deduplicate else {}
+        extensions = _initialize_extensions({"touch_layouts": touch_layouts})
+        return shared_variables, extensions, shared_stimuli
+
+    def _write_blocks(self, out, shared_stimuli, timeline_urls):
+        for idx, b in enumerate(self.blocks):
+            if idx:
+                out.write(",")
+            b._write_js(out, shared_stimuli, _timeline_name(idx, timeline_urls))
+
+    def _shared_stimuli(self):
+        """
+        Return a mapping from the code of every stimulus that occurs more than once
+        in the experiment to the name of its shared definition (the touch layouts
+        of the blocks have to be set)
+        """
+        counts = Counter()
+        for b in self.blocks:
+            for s in b.stimuli:
+                s.to_js()
+                counts[s.js] += 1
+        return {
+            js: f"__sb_stimulus_{cache_key(js)[:12]}"
+            for js, count in counts.items()
+            if count > 1
+        }
+
+    def _write_definitions(self, out, shared_stimuli, timeline_urls=None):
+        if any(b._timeline_columns() for b in self.blocks):
+            out.write(TIMELINE_COLUMNS_JS)
+        if timeline_urls:
+            out.write(TIMELINE_FETCH_JS)
+        for js, name in shared_stimuli.items():
+            out.write(f"const {name} = {js};\n")
+
+    def _write_header(self, out, shared_variables, extensions, path_local_download):
         for s_key in shared_variables:
-            self.js += f"{shared_variables[s_key].set()}\n"
+            out.write(f"{shared_variables[s_key].set()}\n")
         if path_local_download:
             if path_local_download.endswith(".json"):
-                if extensions == "":
-                    self.js += "jsPsych = initJsPsych("
-                else:
-                    self.js += f"jsPsych = initJsPsych({extensions},"
-                self.js += (
-                    f"{{on_finish:()=>jsPsych.data.get().localSave('json',"
-                    f"'{path_local_download}')}});\n"
-                )
+                file_format = "json"
             elif path_local_download.endswith(".csv"):
-                if extensions == "":
-                    self.js += "jsPsych = initJsPsych("
-                else:
-                    self.js += f"jsPsych = initJsPsych({extensions},"
-                self.js += (
-                    f"{{on_finish:()=>jsPsych.data.get().localSave('csv',"
-                    f"'{path_local_download}')}});\n"
-                )
+                file_format = "csv"
             else:
                 raise Exception(
                     "Unknown file format for local download. "
                     "Only .json or .csv are supported."
                 )
+            if extensions == "":
+                out.write("jsPsych = initJsPsych(")
+            else:
+                out.write(f"jsPsych = initJsPsych({extensions},")
+            out.write(
+                f"{{on_finish:()=>jsPsych.data.get().localSave('{file_format}',"
+                f"'{path_local_download}')}});\n"
+            )
         else:
-            self.js += f"jsPsych = initJsPsych({extensions});\n"
-        self.js += "trials = [\n"
-        for b in self.blocks:
-            self.js += b.js
-            self.js += ","
-        self.js = self.js[:-1] + "]\n"
-        self.js += ";jsPsych.run(trials)"
+            out.write(f"jsPsych = initJsPsych({extensions});\n")
 
-    def to_html(self, path, path_local_download=None):
+    def to_html(
+        self,
+        path,
+        path_local_download=None,
+        workers=None,
+        stream=False,
+        deduplicate=False,
+        timeline_files=None,
+        bundle_dir=None,
+    ):
         """
         Save the experiment to an HTML file
+
+        Arguments:
+            path: the path of the HTML file
+            path_local_download: if set, the data is saved locally (.json or .csv)
+                at the end of the experiment
+            workers: the number of Transcrypt compilations to run in parallel
+            stream: if True, the code is written to the file while it is generated
+                (see `write_html`) instead of being assembled in memory first
+            deduplicate: if True, stimuli that generate identical code are defined
+                once as shared constants and referenced by name
+            timeline_files: if "json" or "gzip", the timelines of the blocks are
+                saved next to the HTML file (as `<name>_block<index>.json` or
+                `.json.gz`) and fetched when the experiment starts. The HTML file
+                then has to be served over HTTP(S).
+            bundle_dir: if set, the jsPsych plugins and stylesheets that are used by
+                the stimuli are inlined from this directory (a local mirror of the
+                CDN, see `sweetbean.util.bundle.download_assets`) instead of being
+                loaded from the CDN, so the HTML file works offline
         """
-        self.to_js(path_local_download)
-        html = HTML_PREAMBLE
+        timeline_urls = None
+        if timeline_files is not None:
+            directory, name = os.path.split(os.path.abspath(path))
+            timeline_urls = self.write_timeline_files(
+                directory,
+                os.path.splitext(name)[0],
+                compress=_timeline_compression(timeline_files),
+            )
+        if stream:
+            with open(path, "w", encoding="utf-8") as f:
+                self.write_html(
+                    f,
+                    path_local_download,
+                    workers,
+                    deduplicate,
+                    timeline_urls,
+                    bundle_dir,
+                )
+            return
+        self.to_js(path_local_download, workers, deduplicate, timeline_urls)
+        html = self._html_preamble(bundle_dir)
         blocks = 0
 
         if blocks > 0:
             html += "</script><script>\n"
         html += f"{self.js}" + HTML_APPENDIX
 
-        with open(path, "w") as f:
+        with open(path, "w", encoding="utf-8") as f:
             f.write(html)
 
-    def to_js_string(self, as_function=True, is_async=True):
+    def write_html(
+        self,
+        out,
+        path_local_download=None,
+        workers=None,
+        deduplicate=False,
+        timeline_urls=None,
+        bundle_dir=None,
+    ):
         """
-        Return the experiment as a JavaScript string
+        Write the experiment as an HTML document to a text stream while the code
+        is generated (see `write_js`)
+
+        Arguments:
+            out: a text stream (for example, an open file)
+            path_local_download: if set, the data is saved locally (.json or .csv)
+                at the end of the experiment
+            workers: the number of Transcrypt compilations to run in parallel
+            deduplicate: if True, stimuli that generate identical code are defined
+                once as shared constants and referenced by name
+            timeline_urls: a mapping from the index of a block to the URL of a JSON
+                file with its timeline (see `write_timeline_files`). These timelines
+                are fetched before the experiment starts instead of being inlined.
+            bundle_dir: if set, the plugins are inlined from this directory (see
+                `to_html`)
+        """
+        out.write(self._html_preamble(bundle_dir))
+        self.write_js(out, path_local_download, workers, deduplicate, timeline_urls)
+        out.write(HTML_APPENDIX)
+
+    def _html_preamble(self, bundle_dir=None):
+        """
+        Return the head of the HTML document, which loads only the plugins used by
+        the stimuli
+        """
+        out = io.StringIO()
+        if bundle_dir is None:
+            write_preamble(out, self._stimulus_types())
+        else:
+            write_bundle_preamble(out, self._stimulus_types(), bundle_dir)
+        return out.getvalue()
+
+    def _stimulus_types(self):
+        """
+        Return the jsPsych types of the stimuli in the order they first occur
         """
-        text = FUNCTION_PREAMBLE(is_async) if as_function else ""
-        extensions = ""
+        types = {}
         for b in self.blocks:
-            b.to_js()
-            extensions += _initialize_extensions(b.extensions)
             for s in b.stimuli:
+                types[s.arg.get("type", s.type)] = None
+        return list(types)
 
-                shared_variables = s.return_shared_variables()
-                for s_key in shared_variables:
-                    text += f"{shared_variables[s_key].set()}\n"
-        text += f"const jsPsych = initJsPsych({extensions})\n"
-        text += "const trials = [\n"
+    def to_js_string(
+        self,
+        as_function=True,
+        is_async=True,
+        workers=None,
+        deduplicate=False,
+        timeline_urls=None,
+    ):
+        """
+        Return the experiment as a JavaScript string
+
+        Arguments:
+            as_function: wrap the experiment in a `runExperiment` function
+            is_async: make the function asynchronous
+            workers: the number of Transcrypt compilations to run in parallel
+            deduplicate: if True, stimuli that generate identical code are defined
+                once as shared constants and referenced by name
+            timeline_urls: a mapping from the index of a block to the URL of a JSON
+                file with its timeline (see `write_timeline_files`). These timelines
+                are fetched before the experiment starts instead of being inlined.
+                This requires `is_async`.
+        """
+        timeline_urls = timeline_urls or {}
+        if timeline_urls and not is_async:
+            raise ValueError("Fetching timeline files requires is_async=True.")
+        shared_variables, extensions, shared_stimuli = self._prepare_js(
+            workers, deduplicate
+        )
+        out = io.StringIO()
+        out.write(FUNCTION_PREAMBLE(is_async) if as_function else "")
+        for s_key in shared_variables:
+            out.write(f"{shared_variables[s_key].set()}\n")
+        out.write(f"const jsPsych = initJsPsych({extensions})\n")
+        self._write_definitions(out, shared_stimuli, timeline_urls)
+        if timeline_urls:
+            names, fetch = _fetch_timelines_js(timeline_urls)
+            out.write(f"const [{names}] = await {fetch};\n")
+        out.write("const trials = [\n")
+        self._write_blocks(out, shared_stimuli, timeline_urls)
+        out.write("]\n")
+        out.write(
+            FUNCTION_APPENDIX(is_async) if as_function else TEXT_APPENDIX(is_async)
+        )
+        return out.getvalue()
+
+    def write_timeline_files(self, directory, name="timeline", compress=False):
+        """
+        Save the timeline of every block with a list as timeline to a JSON file
+        and return a mapping from the index of the block to the file name (to be
+        passed as `timeline_urls`)
+
+        Arguments:
+            directory: the directory of the files
+            name: the prefix of the file names (`<name>_block<index>.json`)
+            compress: if True, the files are gzip-compressed (`.json.gz`)
+        """
+        timeline_urls = {}
+        for idx, b in enumerate(self.blocks):
+            if not isinstance(b.timeline, list) or not b.timeline:
+                continue
+            file_name = f"{name}_block{idx}.json"
+            if compress:
+                file_name += ".gz"
+                f = gzip.open(
+                    os.path.join(directory, file_name), "wt", encoding="utf-8"
+                )
+            else:
+                f = open(os.path.join(directory, file_name), "w", encoding="utf-8")
+            with f:
+                b.write_timeline_json(f)
+            timeline_urls[idx] = file_name
+        return timeline_urls
+
+    def _compile_functions(self, workers=None):
+        """
+        Compile all functions used by the stimuli up front with a single Transcrypt
+        run (or `workers` runs in parallel) instead of starting the compiler once
+        per function
+        """
+        functions = []
         for b in self.blocks:
-            text += b.js
-            text += ","
-        text = text[:-1] + "]\n"
-        text += FUNCTION_APPENDIX(is_async) if as_function else TEXT_APPENDIX(is_async)
-        return text
+            for s in b.stimuli:
+                functions += s.return_functions()
+        _compile_fcts(functions, workers)
 
     def run_on_language(
         self,
@@ -113,6 +396,9 @@ class Experiment:
         multi_turn=False,
         preamble="",
         data=None,
+        history=PromptHistory,
+        checkpoint=None,
+        checkpoint_every=1,
     ):
         """
         Run the experiment in a language
@@ -127,9 +413,74 @@ class Experiment:
                 This will rerun the experiment with the data as input.
                 If the data is not provided for the full experiment,
                 the rest of it will be simulated with the get_input function.
+            history: a function that returns an empty `PromptHistory`, which decides
+                the context that is passed to `get_input` if `multi_turn` is False
+                (for example, `functools.partial(SlidingWindowHistory, 50)` to only
+                pass the last 50 prompts). The returned prompts are always complete.
+            checkpoint: a path to a file where the state of the run is appended after
+                every `checkpoint_every` timeline elements. If the file already
+                exists, the run resumes after the last saved timeline element without
+                running the stimuli before it again. The state of `history` is
+                saved as well. The data of the trials has to be JSON-serializable.
+            checkpoint_every: the number of timeline elements between checkpoints
+        """
+        return run_steps(
+            self.run_on_language_steps(
+                multi_turn, preamble, data, history, checkpoint, checkpoint_every
+            ),
+            get_input,
+        )
+
+    async def arun_on_language(
+        self,
+        get_input=input,
+        multi_turn=False,
+        preamble="",
+        data=None,
+        history=PromptHistory,
+        checkpoint=None,
+        checkpoint_every=1,
+    ):
+        """
+        Run the experiment in a language without blocking the event loop
+
+        Like `run_on_language`, but `get_input` can be a coroutine function, which is
+        awaited for every prompt. The stimuli hold the state of the current trial, so
+        participants that run at the same time each need their own experiment.
+
+        Arguments:
+            get_input: a function or coroutine function to get input from the response
+            multi_turn: a boolean to allow multi-turn input.
+                If True, the prompts are not concatenated.
+            preamble: a string to be added before the prompts
+            data: a list of dictionaries with the data (see `run_on_language`)
+            history: a function that returns an empty `PromptHistory`
+                (see `run_on_language`)
+            checkpoint: a path to a checkpoint file (see `run_on_language`)
+            checkpoint_every: the number of timeline elements between checkpoints
+        """
+        return await arun_steps(
+            self.run_on_language_steps(
+                multi_turn, preamble, data, history, checkpoint, checkpoint_every
+            ),
+            get_input,
+        )
+
+    def run_on_language_steps(
+        self,
+        multi_turn=False,
+        preamble="",
+        data=None,
+        history=PromptHistory,
+        checkpoint=None,
+        checkpoint_every=1,
+    ):
+        """
+        Run the experiment in a language as a generator that yields every prompt and
+        expects the response to be sent back. Returns `(out_data, prompts)`.
         """
         out_data = []
-        prompts = []
+        prompts = history()
         shared_variables = {}
         for b in self.blocks:
             for s in b.stimuli:
@@ -137,26 +488,158 @@ class Experiment:
                 for s_key in _shared_variables:
                     shared_variables[s_key] = _shared_variables[s_key].value
         datum_index = 0
-        for b in self.blocks:
+        state = None
+        writer = None
+        if checkpoint:
+            for idx, b in enumerate(self.blocks):
+                if isinstance(b.timeline, list):
+                    check_serializable(b.timeline, f"the timeline of block {idx}")
+            check_serializable(data, "the data")
+            check_serializable(shared_variables, "the shared variables")
+            check_serializable(prompts.get_state(), "the state of the history")
+            state = load_checkpoint(checkpoint)
+            writer = CheckpointWriter(checkpoint, checkpoint_every, state)
+        if state:
+            out_data = state.out_data
+            prompts.extend(state.prompts)
+            prompts.set_state(state.history)
+            shared_variables.update(state.shared_variables)
+            datum_index = state.datum_index
+        for block_idx, b in enumerate(self.blocks):
+            resumed = state is not None and block_idx == state.block
+            if state and block_idx < state.block:
+                continue
+            if not resumed or not state.trial:
+                prompts.start_block()
             timeline = b.timeline
             stimuli = b.stimuli
             if not timeline:
                 timeline = [{}]
-            for timeline_element in timeline:
-                out_data, prompts, shared_variables, datum_index = run_stimuli(
-                    stimuli,
-                    timeline_element,
-                    out_data,
-                    shared_variables,
-                    prompts,
-                    get_input,
-                    multi_turn,
-                    datum_index,
-                    data,
-                    preamble,
+            for trial_idx, timeline_element in enumerate(timeline):
+                if resumed and trial_idx < state.trial:
+                    continue
+                out_data, prompts, shared_variables, datum_index = yield from (
+                    run_stimuli_steps(
+                        stimuli,
+                        timeline_element,
+                        out_data,
+                        shared_variables,
+                        prompts,
+                        multi_turn,
+                        datum_index,
+                        data,
+                        preamble,
+                    )
                 )
+                if writer:
+                    writer.write(
+                        LanguageCheckpoint(
+                            out_data,
+                            prompts,
+                            shared_variables,
+                            datum_index,
+                            block_idx,
+                            trial_idx + 1,
+                            prompts.get_state(),
+                        ),
+                        force=block_idx == len(self.blocks) - 1
+                        and trial_idx == len(timeline) - 1,
+                    )
         return out_data, prompts
 
+    def run_on_language_many(
+        self,
+        n,
+        get_input,
+        multi_turn=False,
+        preamble="",
+        data=None,
+        history=PromptHistory,
+        max_concurrency=8,
+    ):
+        """
+        Run the experiment in a language for several independent participants at
+        the same time
+
+        Every participant runs on its own copy of the blocks in a thread pool, so
+        slow calls of `get_input` (for example, requests to a remote model) overlap.
+        `get_input` is called from several threads and has to be thread-safe. It
+        can also be a coroutine function, in which case all calls run on one event
+        loop in a background thread.
+
+        Arguments:
+            n: the number of participants
+            get_input: a function to get input from the response (see
+                `run_on_language`)
+            multi_turn: a boolean to allow multi-turn input.
+                If True, the prompts are not concatenated.
+            preamble: a string to be added before the prompts or a list with one
+                string per participant
+            data: a list with the data of each participant (see `run_on_language`)
+            history: a function that returns an empty `PromptHistory`
+                (see `run_on_language`)
+            max_concurrency: the maximum number of participants that run at the
+                same time
+
+        Returns:
+            a list with `(out_data, prompts)` for each participant (in order)
+        """
+        preamble, data = _participant_args(n, preamble, data)
+
+        with BackgroundLoop() as loop:
+            _get_input = sync_callable(get_input, loop)
+
+            def _run_participant(idx):
+                experiment = Experiment(copy.deepcopy(self.blocks))
+                return experiment.run_on_language(
+                    _get_input, multi_turn, preamble[idx], data[idx], history
+                )
+
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                return list(executor.map(_run_participant, range(n)))
+
+    def run_on_language_batch(
+        self,
+        n,
+        get_input_batch,
+        multi_turn=False,
+        preamble="",
+        data=None,
+        history=PromptHistory,
+    ):
+        """
+        Run the experiment in a language for several participants in lock-step,
+        getting the responses of all participants to their current prompt in one call
+
+        This lets model servers that are more efficient on batches (for example, a
+        local inference server) process the prompts of all participants at once.
+        Participants that already finished (for example, because their data was
+        replayed) are not part of later batches.
+
+        Arguments:
+            n: the number of participants
+            get_input_batch: a function that gets a list of prompts and returns a
+                list with the response to each of them (in the same order)
+            multi_turn: a boolean to allow multi-turn input.
+                If True, the prompts are not concatenated.
+            preamble: a string to be added before the prompts or a list with one
+                string per participant
+            data: a list with the data of each participant (see `run_on_language`)
+            history: a function that returns an empty `PromptHistory`
+                (see `run_on_language`)
+
+        Returns:
+            a list with `(out_data, prompts)` for each participant (in order)
+        """
+        preamble, data = _participant_args(n, preamble, data)
+        steps = [
+            Experiment(copy.deepcopy(self.blocks)).run_on_language_steps(
+                multi_turn, preamble[idx], data[idx], history
+            )
+            for idx in range(n)
+        ]
+        return run_steps_batch(steps, get_input_batch)
+
 
 def run_stimuli(
     stimuli,
@@ -169,6 +652,33 @@ def run_stimuli(
     datum_index,
     data,
     preamble,
+):
+    return run_steps(
+        run_stimuli_steps(
+            stimuli,
+            timeline_element,
+            out_data,
+            shared_variables,
+            prompts,
+            multi_turn,
+            datum_index,
+            data,
+            preamble,
+        ),
+        get_input,
+    )
+
+
+def run_stimuli_steps(
+    stimuli,
+    timeline_element,
+    out_data,
+    shared_variables,
+    prompts,
+    multi_turn,
+    datum_index,
+    data,
+    preamble,
 ):
     for s in stimuli:
         if data and datum_index < len(data):
@@ -177,13 +687,10 @@ def run_stimuli(
             datum = None
         s._prepare_args_l(timeline_element, out_data, shared_variables, datum)
 
-        def _get_input(_prompt):
-            if not preamble:
-                return get_input(_prompt)
-            else:
-                return get_input(f"{preamble} {_prompt}")
-
-        s_out_data, prompts = s.process_l(prompts, _get_input, multi_turn, datum)
+        steps = _process_l_steps(s, prompts, multi_turn, datum)
+        if preamble:
+            steps = _with_preamble(steps, preamble)
+        s_out_data, prompts = yield from steps
         out_data.append(s_out_data)
         if s.side_effects:
             s._resolve_side_effects(timeline_element, out_data, shared_variables)
@@ -199,39 +706,83 @@ def run_stimuli(
     return out_data, prompts, shared_variables, datum_index
 
 
+def _process_l_steps(s, prompts, multi_turn, datum):
+    if type(s).process_l is _BaseStimulus.process_l:
+        return s.process_l_steps(prompts, multi_turn, datum)
+    # stimuli that override `process_l` call `get_input` themselves
+    return steps_from_callable(
+        lambda get_input: s.process_l(prompts, get_input, multi_turn, datum)
+    )
+
+
+def _with_preamble(steps, preamble):
+    try:
+        prompt = next(steps)
+        while True:
+            prompt = steps.send((yield f"{preamble} {prompt}"))
+    except StopIteration as stop:
+        return stop.value
+
+
+def _participant_args(n, preamble, data):
+    if isinstance(preamble, str):
+        preamble = [preamble] * n
+    if len(preamble) != n or (data is not None and len(data) != n):
+        raise ValueError("preamble and data need one entry per participant.")
+    if data is None:
+        data = [None] * n
+    return preamble, data
+
+
+def _timeline_compression(timeline_files):
+    if timeline_files not in ("json", "gzip"):
+        raise ValueError(
+            f"Unknown format for timeline files: {timeline_files}. "
+            'Only "json" or "gzip" are supported.'
+        )
+    return timeline_files == "gzip"
+
+
+def _timeline_name(idx, timeline_urls):
+    if idx not in timeline_urls:
+        return None
+    return f"sweetbeanTimeline{idx}"
+
+
+def _fetch_timelines_js(timeline_urls):
+    names = ",".join(_timeline_name(idx, timeline_urls) for idx in timeline_urls)
+    urls = ",".join(
+        f"{TIMELINE_FETCH_FUNCTION}({json.dumps(url)})"
+        for url in timeline_urls.values()
+    )
+    return names, f"Promise.all([{urls}])"
+
+
+def _write_timeline_fetch(out, timeline_urls):
+    if timeline_urls:
+        names, fetch = _fetch_timelines_js(timeline_urls)
+        out.write(f"{fetch}.then(([{names}])=>{{\n")
+
+
 def _initialize_extensions(extensions):
-    all = ""
-    t_l = ""
-    if (
-        "touch_layouts" in extensions
-        and len(extensions["touch_layouts"]) > 0
-        and any(extensions["touch_layouts"])
-    ):
-        t_l += "{type: jsPsychExtensionTouchscreenButtons, params: {"
-        for touch_layout in extensions["touch_layouts"]:
-            if not touch_layout:
-                continue
-            for key, item in touch_layout.items():
-                t_l += f"{key}"
-                t_l += ":["
-                _v = ""
-                if item:
-                    for _k in item:
-                        _v += "{key:"
-                        _v += f'"{_k["key"]}"'
-                        if "color" in _k:
-                            _v += f',color: "{_k["color"]}"'
-                        if "preset" in _k:
-                            _v += f',preset: "{_k["preset"]}"'
-                        _v += "},"
-                if _v:
-                    _v = _v[:-1]
-                t_l += _v
-                t_l += "],"
-            t_l = t_l[:-1]
-            if t_l:
-                t_l += "}"
-    if t_l:
-        all = "{extensions: [" + t_l + "}]},"
-
-    return all
+    if "touch_layouts" not in extensions or not any(extensions["touch_layouts"]):
+        return ""
+    layouts = []
+    for touch_layout in extensions["touch_layouts"]:
+        if not touch_layout:
+            continue
+        for key, item in touch_layout.items():
+            buttons = []
+            for _k in item or []:
+                button = f'{{key:"{_k["key"]}"'
+                if "color" in _k:
+                    button += f',color: "{_k["color"]}"'
+                if "preset" in _k:
+                    button += f',preset: "{_k["preset"]}"'
+                buttons.append(button + "}")
+            layouts.append(f"{key}:[{','.join(buttons)}]")
+    return (
+        "{extensions: [{type: jsPsychExtensionTouchscreenButtons, params: {"
+        + ",".join(layouts)
+        + "}}]},"
+    )
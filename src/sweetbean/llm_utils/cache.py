@@ -0,0 +1,157 @@
+import inspect
+import json
+import os
+import sqlite3
+import threading
+
+from sweetbean.util.cache import CacheInfo, cache_key, default_cache_dir
+
+
+class ResponseCache:
+    """
+    A persistent cache for the responses to prompts in language mode
+
+    Responses are stored in an SQLite file and keyed on the exact prompt, the model
+    and the sampling parameters, so re-running a simulation with unchanged prompts
+    does not call the model again:
+
+        cache = ResponseCache("responses.sqlite", model="my-model", temperature=0)
+        data, prompts = experiment.run_on_language(cache.wrap(generate))
+        print(cache.info())
+
+    Only use it for deterministic sampling (or if the same response for the same
+    prompt is wanted), since a cached response is returned for every repetition.
+    """
+
+    def __init__(self, path=None, model="", **params):
+        """
+        Arguments:
+            path: the SQLite file (`responses.sqlite` in the sweetbean cache
+                directory by default)
+            model: the name of the model
+            params: the sampling parameters (for example, `temperature`)
+        """
+        if path is None:
+            path = os.path.join(default_cache_dir(), "responses.sqlite")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.model = model
+        self.params = params
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, prompt TEXT, response TEXT)"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def key(self, prompt):
+        return cache_key(self.model, json.dumps(self.params, sort_keys=True), prompt)
+
+    def get(self, prompt):
+        """
+        Return `(True, response)` if there is a response to the prompt and
+        `(False, None)` otherwise
+        """
+        row = None
+        with self._lock:
+            if self.enabled:
+                row = self._connection.execute(
+                    "SELECT response FROM responses WHERE key = ?",
+                    (self.key(prompt),),
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, json.loads(row[0])
+
+    def set(self, prompt, response):
+        if not self.enabled:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (self.key(prompt), prompt, json.dumps(response)),
+            )
+
+    def wrap(self, get_input):
+        """
+        Wrap `get_input` so it is only called for prompts without a cached response.
+        `get_input` can also be a coroutine function (see `arun_on_language`).
+        """
+
+        def _get_input(prompt):
+            found, response = self.get(prompt)
+            if found:
+                return response
+            response = get_input(prompt)
+            if inspect.isawaitable(response):
+                return self._set_awaited(prompt, response)
+            self.set(prompt, response)
+            return response
+
+        return _get_input
+
+    async def _set_awaited(self, prompt, awaitable):
+        response = await awaitable
+        self.set(prompt, response)
+        return response
+
+    def wrap_batch(self, get_input_batch):
+        """
+        Wrap `get_input_batch` (see `run_on_language_batch`) so it is only called
+        with the prompts without a cached response
+        """
+
+        def _get_input_batch(prompts):
+            responses = []
+            missing = []
+            for idx, prompt in enumerate(prompts):
+                found, response = self.get(prompt)
+                responses.append(response)
+                if not found:
+                    missing.append(idx)
+            if missing:
+                new_responses = get_input_batch([prompts[idx] for idx in missing])
+                if len(new_responses) != len(missing):
+                    raise ValueError(
+                        f"get_input_batch returned {len(new_responses)} responses "
+                        f"for {len(missing)} prompts."
+                    )
+                for idx, response in zip(missing, new_responses):
+                    self.set(prompts[idx], response)
+                    responses[idx] = response
+            return responses
+
+        return _get_input_batch
+
+    def clear(self):
+        """
+        Remove all responses and reset the counters.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        with self._lock:
+            (size,) = self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+        return CacheInfo(self.hits, self.misses, size)
@@ -1,4 +1,4 @@
-from jinja2 import Template
+from sweetbean.util.templates import get_template
 
 
 def demographic(age, gender):
@@ -22,4 +22,4 @@ def demographic(age, gender):
     template = "You are a {{ age }}-year-old {{ gender }}."
 
     # Render the template with local variables
-    return Template(template).render(age=age, gender=gender)
+    return get_template(template).render(age=age, gender=gender)
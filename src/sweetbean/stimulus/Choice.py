@@ -1,6 +1,7 @@
 import math
 
 from sweetbean.stimulus.Stimulus import _BaseStimulus
+from sweetbean.util.history import join_prompts
 from sweetbean.util.parse import to_js
 from sweetbean.variable import FunctionVariable
 
@@ -66,7 +67,7 @@ class HtmlChoice(_BaseStimulus):
     def _set_before(self):
         pass
 
-    def process_l(self, prompts, get_input, multi_turn):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         raise NotImplementedError
 
 
@@ -176,7 +177,7 @@ class Bandit(HtmlChoice):
         )
         self.js_before = f"on_load:()=>{{{res}}},"
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         current_prompt = f' You see {len(self.l_args["bandits"])} bandits.'
         for idx, bandit in enumerate(self.l_args["bandits"]):
             current_prompt += f' Bandit {idx + 1} is {bandit["color"]}.'
@@ -184,12 +185,12 @@ class Bandit(HtmlChoice):
             " Choose a bandit by naming the number of the bandit. You name "
         )
         if not multi_turn:
-            in_prompt = " ".join([p for p in prompts]) + current_prompt + "<<"
+            in_prompt = join_prompts(prompts) + current_prompt + "<<"
         else:
             in_prompt = current_prompt + "<<"
         rest_data = None
         if not datum:
-            _r = get_input(in_prompt)
+            _r = yield in_prompt
             if isinstance(_r, str):
                 response = _r
             elif isinstance(_r, dict):
@@ -268,5 +268,5 @@ class Foraging(_BaseStimulus):
         pass
 
     # Language mode not supported (same as RSVP)
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         raise NotImplementedError
@@ -255,5 +255,5 @@ class Gabor(_BaseStimulus):
         pass
 
     # Language mode not supported
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         raise NotImplementedError
@@ -266,7 +266,7 @@ class RSVP(_BaseStimulus):
     def _set_before(self):
         pass
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         raise NotImplementedError
 
 
@@ -404,5 +404,5 @@ class BilateralRSVP(_BaseStimulus):
     def _set_before(self):
         pass
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         raise NotImplementedError
@@ -2,13 +2,15 @@ import uuid
 from abc import ABC, abstractmethod
 from typing import List, Union
 
-from jinja2 import Template
-
+from sweetbean._const import IMAGE_READY_WRAPPER
 from sweetbean.extension.TouchButton import (
     TouchButton,
     collect_touch_buttons_from_function,
 )
+from sweetbean.util.aio import run_steps
+from sweetbean.util.history import join_prompts
 from sweetbean.util.parse import to_js
+from sweetbean.util.templates import get_template
 from sweetbean.variable import (
     DataVariable,
     FunctionVariable,
@@ -74,6 +76,31 @@ class _BaseStimulus(ABC):
                 extract_shared_variables(se.set_variable)
         return shared_variables
 
+    def return_functions(self):
+        functions = []
+
+        def extract_functions(value):
+            if isinstance(value, FunctionVariable):
+                functions.append(value.fct)
+                for arg in value.args:
+                    extract_functions(arg)
+            elif isinstance(value, dict):
+                for v in value.values():
+                    extract_functions(v)
+            elif isinstance(value, (list, tuple)):
+                for item in value:
+                    extract_functions(item)
+
+        for key in self.arg_js:
+            extract_functions(self.arg_js[key])
+        for key in self.arg:
+            if key not in self.arg_js:
+                extract_functions(self.arg[key])
+        if self.side_effects:
+            for se in self.side_effects:
+                extract_functions(se.get_variable)
+        return functions
+
     def to_js(self):
         self.js = ""
         self.js_data = ""
@@ -90,7 +117,7 @@ class _BaseStimulus(ABC):
         self.js_before = ""
         self.js_body = ""
         self._params_to_js_from_prepared()
-        self.js = (
+        self.js = IMAGE_READY_WRAPPER(
             f"{{{self.js_body}{self.js_before}on_finish:(data)=>{{{self.js_data}}}}}"
         )
 
@@ -158,6 +185,15 @@ class _BaseStimulus(ABC):
         self.js_body += "extensions:" + res
 
     def process_l(self, prompts, get_input, multi_turn, datum=None):
+        return run_steps(self.process_l_steps(prompts, multi_turn, datum), get_input)
+
+    def process_l_steps(self, prompts, multi_turn, datum=None):
+        """
+        Process the stimulus in a language as a generator: every prompt that
+        needs a response is yielded and the response is sent back, so the caller
+        decides how to get it (for example, by awaiting a coroutine). Returns
+        `(data, prompts)`.
+        """
         prompts.append(self._get_prompt_l())
         prompt_response = self._get_response_prompt_l()
         s_data = {}
@@ -167,9 +203,9 @@ class _BaseStimulus(ABC):
             if multi_turn:
                 _in_prompt = prompts[-1]
             else:
-                _in_prompt = " ".join([p for p in prompts])
+                _in_prompt = join_prompts(prompts)
             if not datum:
-                _r = get_input(_in_prompt)
+                _r = yield _in_prompt
                 if isinstance(_r, str):
                     response = _r.upper()
                 elif isinstance(_r, dict):
@@ -190,7 +226,7 @@ class _BaseStimulus(ABC):
     def _get_prompt_l(self):
         if self.l_template is None:
             raise Exception("No template or function set for getting prompt")
-        return Template(self.l_template).render(self.l_args)
+        return get_template(self.l_template).render(self.l_args)
 
     def _get_response_prompt_l(self):
         raise Exception("No template or function set for getting response prompt")
@@ -310,7 +346,7 @@ class _KeyboardResponseStimulus(_BaseStimulus, ABC):
     def _get_response_prompt_l(self):
         if not self.l_args["choices"]:
             return None
-        return Template(self.response_template).render(
+        return get_template(self.response_template).render(
             {"choices": [c.upper() for c in self.l_args["choices"]]}
         )
 
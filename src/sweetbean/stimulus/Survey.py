@@ -1,4 +1,5 @@
 from sweetbean.stimulus.Stimulus import _BaseStimulus
+from sweetbean.util.history import join_prompts
 from sweetbean.variable import FunctionVariable
 
 
@@ -47,7 +48,7 @@ class TextSurvey(_Survey):
         questions_ = FunctionVariable("questions", get_prompts, [questions])
         super().__init__(questions_, side_effects=side_effects)
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         current_prompt = []
         responses = {}
         data = self.l_args.copy()
@@ -55,14 +56,14 @@ class TextSurvey(_Survey):
             current_prompt.append(question["prompt"])
             if not multi_turn:
                 _in_prompt = (
-                    " ".join([p for p in prompts])
+                    join_prompts(prompts)
                     + " ".join([c for c in current_prompt])
                     + "<<"
                 )
             else:
                 _in_prompt = current_prompt[-1] + "<<"
             if not datum:
-                response = get_input(_in_prompt)
+                response = yield _in_prompt
             else:
                 response = datum["response"][f"Q{str(idx)}"]
             current_prompt[-1] += f"<<{response}>>"
@@ -97,7 +98,7 @@ class MultiChoiceSurvey(_Survey):
         questions_ = FunctionVariable("questions", get_prompts, [questions])
         super().__init__(questions_, side_effects=side_effects)
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         current_prompt = []
         responses = {}
         data = self.l_args.copy()
@@ -108,14 +109,14 @@ class MultiChoiceSurvey(_Survey):
             )
             if not multi_turn:
                 _in_prompt = (
-                    " ".join([p for p in prompts])
+                    join_prompts(prompts)
                     + " ".join([c for c in current_prompt])
                     + "<<"
                 )
             else:
                 _in_prompt = current_prompt[-1] + "<<"
             if not datum:
-                response = get_input(_in_prompt)
+                response = yield _in_prompt
             else:
                 response = datum["response"][f"Q{str(idx)}"]
             current_prompt[-1] += f"<<{response}>>"
@@ -172,7 +173,7 @@ class LikertSurvey(_Survey):
             prompts_.append({"prompt": p, "labels": scale})
         return cls(prompts_, side_effects=side_effects)
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         current_prompt = []
         responses = {}
         data = self.l_args.copy()
@@ -183,14 +184,14 @@ class LikertSurvey(_Survey):
             )
             if not multi_turn:
                 _in_prompt = (
-                    " ".join([p for p in prompts])
+                    join_prompts(prompts)
                     + " ".join([c for c in current_prompt])
                     + "<<"
                 )
             else:
                 _in_prompt = current_prompt[-1] + "<<"
             if not datum:
-                response = get_input(_in_prompt)
+                response = yield _in_prompt
             else:
                 response = datum["response"][f"Q{str(idx)}"]
             current_prompt[-1] += f"<<{response}>>"
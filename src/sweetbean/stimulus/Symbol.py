@@ -232,5 +232,5 @@ class Symbol(_BaseStimulus):
     def _set_before(self):
         pass
 
-    def process_l(self, prompts, get_input, multi_turn, datum=None):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         raise NotImplementedError
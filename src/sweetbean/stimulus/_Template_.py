@@ -13,15 +13,21 @@ class _Template_(_BaseStimulus):
         """
         super().__init__(args, side_effects)
 
-    def process_l(self, prompts, get_input, multi_turn, datum):
+    def process_l_steps(self, prompts, multi_turn, datum=None):
         """
         This is used to process the arguments, generate a prompt and
-        get a response from language input
+        get a response from language input (`response = yield prompt`)
         """
         data = self.l_args.copy()
         # Add your code for prompt generation here:
-
+        prompt = ""
+        # The response is sent back by the runner (or taken from the data):
+        if not datum:
+            response = yield prompt
+        else:
+            response = datum["response"]
         # Add your code for processing the response and adding to data here:
+        data.update({"response": response})
         return data, prompts
 
     def _add_special_param(self):
@@ -0,0 +1,155 @@
+import asyncio
+import inspect
+import queue
+import threading
+
+
+class BackgroundLoop:
+    """
+    An event loop that runs in a background thread, so synchronous code (for example,
+    worker threads) can wait for coroutines:
+
+        with BackgroundLoop() as loop:
+            result = loop.run(coroutine)
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def run(self, awaitable):
+        """
+        Wait for an awaitable on the background loop and return its result
+        """
+        return asyncio.run_coroutine_threadsafe(_await(awaitable), self.loop).result()
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def sync_callable(fct, loop):
+    """
+    Wrap a function that may return an awaitable (for example, a coroutine function)
+    in a synchronous function that waits for the result on a `BackgroundLoop`
+    """
+
+    def _fct(*args, **kwargs):
+        result = fct(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = loop.run(result)
+        return result
+
+    return _fct
+
+
+def run_steps(steps, get_input):
+    """
+    Run a generator that yields prompts (for example, `process_l_steps`) by sending
+    back the response of `get_input` to every prompt and return its result
+    """
+    try:
+        prompt = next(steps)
+        while True:
+            prompt = steps.send(get_input(prompt))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def arun_steps(steps, get_input):
+    """
+    Like `run_steps`, but `get_input` may return an awaitable (for example, if it is
+    a coroutine function), which is awaited without blocking the event loop
+    """
+    try:
+        prompt = next(steps)
+        while True:
+            response = get_input(prompt)
+            if inspect.isawaitable(response):
+                response = await response
+            prompt = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+def run_steps_batch(steps, get_input_batch):
+    """
+    Run several generators that yield prompts in lock-step: the current prompts of
+    all unfinished generators are passed to `get_input_batch` in one call, which
+    returns the responses in the same order. Returns the results of the generators
+    (in order).
+    """
+    results = [None] * len(steps)
+    pending = {}
+
+    def _advance(idx, response=None, start=False):
+        try:
+            pending[idx] = next(steps[idx]) if start else steps[idx].send(response)
+        except StopIteration as stop:
+            pending.pop(idx, None)
+            results[idx] = stop.value
+
+    for idx in range(len(steps)):
+        _advance(idx, start=True)
+    while pending:
+        indices = list(pending)
+        responses = get_input_batch([pending[idx] for idx in indices])
+        if len(responses) != len(indices):
+            raise ValueError(
+                f"get_input_batch returned {len(responses)} responses "
+                f"for {len(indices)} prompts."
+            )
+        for idx, response in zip(indices, responses):
+            _advance(idx, response)
+    return results
+
+
+def steps_from_callable(fct):
+    """
+    Turn a function that gets a synchronous `get_input` and returns a result (for
+    example, `process_l` of a stimulus that overrides it) into a generator like
+    `process_l_steps`. The function runs in a thread that waits for every response.
+    """
+    prompts = queue.Queue()
+    responses = queue.Queue()
+
+    def _get_input(prompt):
+        prompts.put((False, prompt))
+        error, response = responses.get()
+        if error:
+            raise response
+        return response
+
+    def _run():
+        try:
+            prompts.put((True, (False, fct(_get_input))))
+        except BaseException as e:
+            prompts.put((True, (True, e)))
+
+    threading.Thread(target=_run, daemon=True).start()
+    while True:
+        done, value = prompts.get()
+        if done:
+            error, result = value
+            if error:
+                raise result
+            return result
+        try:
+            response = yield value
+        except BaseException as e:
+            # let the function stop before passing on the exception
+            responses.put((True, e))
+            prompts.get()
+            raise
+        responses.put((False, response))
@@ -0,0 +1,180 @@
+import os
+import re
+from collections import namedtuple
+from urllib.request import urlopen
+
+from sweetbean._const import (
+    CDN,
+    DEFAULT_SCRIPT,
+    DEPENDENCIES,
+    JSPSYCH,
+    PACKAGE_CDNS,
+    SCRIPTS,
+    STYLESHEETS,
+    SWEETBEAN_RUNTIME,
+    TYPE_STYLESHEETS,
+)
+
+Asset = namedtuple("Asset", ["package", "version", "file"])
+
+_SOURCE_MAP = re.compile(r"^[ \t]*//[#@][ \t]*sourceMappingURL=.*$", re.MULTILINE)
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+
+
+def asset_url(asset):
+    """
+    Return the URL of an asset on its CDN
+    """
+    cdn = PACKAGE_CDNS.get(asset.package, CDN)
+    return f"{cdn}/{asset.package}@{asset.version}/{asset.file}"
+
+
+def asset_path(asset, directory):
+    """
+    Return the path of an asset in a local directory that mirrors the CDN
+    (`<directory>/<package>@<version>/<file>`)
+    """
+    return os.path.join(
+        directory, f"{asset.package}@{asset.version}", *asset.file.split("/")
+    )
+
+
+def required_assets(types):
+    """
+    Return the scripts and stylesheets needed to run stimuli of the given jsPsych
+    types (types without a known plugin are skipped)
+
+    Examples:
+        >>> scripts, stylesheets = required_assets(["jsPsychHtmlKeyboardResponse"])
+        >>> [s.package for s in scripts]
+        ['jspsych', '@jspsych/plugin-html-keyboard-response', 'sweetbean']
+        >>> [s.file for s in stylesheets]
+        ['css/jspsych.css', 'dist/style/main.css']
+    """
+    packages = {**JSPSYCH}
+    for t in types:
+        packages.update(DEPENDENCIES.get(t, {}))
+    packages.update(SWEETBEAN_RUNTIME)
+    scripts = [
+        Asset(package, version, SCRIPTS.get(package, DEFAULT_SCRIPT))
+        for package, version in packages.items()
+    ]
+
+    stylesheets = []
+    sheets = [STYLESHEETS] + [
+        TYPE_STYLESHEETS[t] for t in types if t in TYPE_STYLESHEETS
+    ]
+    for files in sheets:
+        for package, package_files in files.items():
+            for file in package_files:
+                asset = Asset(package, packages[package], file)
+                if asset not in stylesheets:
+                    stylesheets.append(asset)
+    return scripts, stylesheets
+
+
+def minify_js(code):
+    """
+    Prepare a published browser build for inlining: the builds are already
+    minified, so only references to source maps (which are not bundled) are removed
+
+    Examples:
+        >>> minify_js("let a=1;\\n//# sourceMappingURL=index.browser.min.js.map\\n")
+        'let a=1;'
+    """
+    return _SOURCE_MAP.sub("", code).strip()
+
+
+def minify_css(code):
+    """
+    Remove comments and redundant whitespace from a stylesheet
+
+    Examples:
+        >>> minify_css("/* title */\\nh1 ,h2 {\\n  color: red;\\n}\\n")
+        'h1,h2{color: red;}'
+    """
+    code = _CSS_COMMENT.sub("", code)
+    code = _CSS_SPACE.sub(" ", code)
+    return _CSS_PUNCTUATION.sub(r"\1", code).strip()
+
+
+def _escape(code, tag):
+    # the inlined code must not close the surrounding tag
+    return code.replace(f"</{tag}", f"<\\/{tag}")
+
+
+def _read_asset(asset, directory):
+    path = asset_path(asset, directory)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} does not exist. Download {asset_url(asset)} to this path "
+            "(see `download_assets`)."
+        )
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def write_preamble(out, types):
+    """
+    Write the head of an HTML document that loads the scripts and stylesheets
+    needed by the given jsPsych types from their CDN
+
+    Arguments:
+        out: a text stream
+        types: the jsPsych types of the stimuli
+    """
+    scripts, stylesheets = required_assets(types)
+    out.write("<!DOCTYPE html>\n<head>\n<title>My awesome experiment</title>")
+    for asset in scripts:
+        out.write(f'<script src="{asset_url(asset)}"></script>\n')
+    for asset in stylesheets:
+        out.write(
+            f'<link href="{asset_url(asset)}" rel="stylesheet" type="text/css"/>\n'
+        )
+    out.write("</head>\n<body></body>\n<script>\n")
+
+
+def write_bundle_preamble(out, types, directory):
+    """
+    Write the head of a self-contained HTML document that inlines the (minified)
+    scripts and stylesheets needed by the given jsPsych types
+
+    Arguments:
+        out: a text stream
+        types: the jsPsych types of the stimuli
+        directory: a local directory that mirrors the CDN (see `asset_path`)
+    """
+    scripts, stylesheets = required_assets(types)
+    out.write("<!DOCTYPE html>\n<head>\n<title>My awesome experiment</title>")
+    for asset in scripts:
+        code = minify_js(_read_asset(asset, directory))
+        out.write(f"<script>{_escape(code, 'script')}</script>\n")
+    for asset in stylesheets:
+        code = minify_css(_read_asset(asset, directory))
+        out.write(f"<style>{_escape(code, 'style')}</style>\n")
+    out.write("</head>\n<body></body>\n<script>\n")
+
+
+def download_assets(directory, types=None):
+    """
+    Download the scripts and stylesheets needed by the given jsPsych types (all
+    known types by default) into a local directory (see `write_bundle_preamble`)
+
+    Arguments:
+        directory: the directory that mirrors the CDN
+        types: the jsPsych types of the stimuli
+    """
+    if types is None:
+        types = list(DEPENDENCIES)
+    scripts, stylesheets = required_assets(types)
+    for asset in scripts + stylesheets:
+        path = asset_path(asset, directory)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with urlopen(asset_url(asset)) as response:
+            content = response.read()
+        with open(path, "wb") as f:
+            f.write(content)
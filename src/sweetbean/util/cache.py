@@ -0,0 +1,225 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from typing import Any, Dict, Hashable, Optional
+
+CACHE_DIR_ENV = "SWEETBEAN_CACHE_DIR"
+NO_CACHE_ENV = "SWEETBEAN_NO_CACHE"
+
+
+def default_cache_dir():
+    """
+    Return the root directory for on-disk caches.
+
+    Uses `SWEETBEAN_CACHE_DIR` if set, otherwise `$XDG_CACHE_HOME/sweetbean`
+    (falling back to `~/.cache/sweetbean`).
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(root, "sweetbean")
+
+
+def cache_key(*parts):
+    """
+    Create a stable hex digest from a sequence of strings or bytes.
+
+    Examples:
+        >>> cache_key("a", "bc") == cache_key("ab", "c")
+        False
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    A content-addressed file cache with size-bounded LRU eviction.
+
+    Each entry is stored as a single file named after its key. Reading an entry
+    refreshes its modification time, and when the cache grows beyond `max_size`
+    bytes the least recently used entries are removed until it is at most 80% of
+    `max_size`. The size is tracked while writing, so the directory is only listed
+    when entries are evicted or after every 20% of `max_size` written. Listing it
+    again counts the entries written by other processes that share the directory,
+    which can therefore exceed `max_size` by up to 20% per process until the next
+    listing. Errors while reading or writing are treated as cache misses, so a
+    broken cache never breaks a build.
+
+    The cache can be disabled by setting `enabled = False` or by setting the
+    environment variable `SWEETBEAN_NO_CACHE`.
+    """
+
+    def __init__(self, name, max_size=64 * 1024 * 1024, suffix="", directory=None):
+        """
+        Arguments:
+            name: the name of the sub-directory inside the cache root
+            max_size: the maximum size of the cache in bytes
+            suffix: the file extension of the entries (for example, ".js")
+            directory: an explicit directory (overrides the default cache root)
+        """
+        self.name = name
+        self.max_size = max_size
+        self.suffix = suffix
+        self._directory = directory
+        self.enabled = not os.environ.get(NO_CACHE_ENV)
+        # the total size of the entries in `_size_directory` (None if unknown) and
+        # the number of bytes written since it was read from the directory
+        self._size = None
+        self._size_directory = None
+        self._written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return self._directory
+        return os.path.join(default_cache_dir(), self.name)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def set(self, key, value: bytes):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write to a temporary file first so concurrent readers never see
+            # partially written entries
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            path = self._path(key)
+            with self._lock:
+                size = self._total_size()
+                try:
+                    size -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(tmp_path, path)
+                self._size = size + len(value)
+                self._written += len(value)
+                if self._written > self.max_size * 0.2:
+                    # other processes may have written to the directory as well
+                    self._size = None
+                    self._total_size()
+                if self._size > self.max_size:
+                    self._evict()
+        except OSError:
+            return
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._size = None
+
+    def _entries(self):
+        try:
+            return [
+                e
+                for e in os.scandir(self.directory)
+                if e.is_file()
+                and e.name.endswith(self.suffix)
+                and not e.name.endswith(".tmp")
+            ]
+        except OSError:
+            return []
+
+    def _total_size(self):
+        if self._size is None or self._size_directory != self.directory:
+            self._size_directory = self.directory
+            self._size = sum(size for _, size, _ in self._stats())
+            self._written = 0
+        return self._size
+
+    def _stats(self):
+        stats = []
+        for e in self._entries():
+            try:
+                stat = e.stat()
+            except OSError:
+                continue
+            stats.append((stat.st_mtime, stat.st_size, e.path))
+        return stats
+
+    def _evict(self):
+        entries = sorted(self._stats())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_size * 0.8
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+        self._written = 0
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "size"])
+
+
+class MemoryCache:
+    """
+    An in-process cache that counts hits and misses (for profiling).
+    """
+
+    def __init__(self):
+        self._data: Dict[Hashable, Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+
+    def __contains__(self, key):
+        return self.enabled and key in self._data
+
+    def get(self, key):
+        if self.enabled and key in self._data:
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if self.enabled:
+            self._data[key] = value
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters.
+        """
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, len(self._data))
@@ -0,0 +1,115 @@
+import json
+import os
+from collections import namedtuple
+
+# the state of a language run before the timeline element `trial` of the block
+# `block` (`history` is the state of the context, see `PromptHistory.get_state`)
+LanguageCheckpoint = namedtuple(
+    "LanguageCheckpoint",
+    [
+        "out_data",
+        "prompts",
+        "shared_variables",
+        "datum_index",
+        "block",
+        "trial",
+        "history",
+    ],
+)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint file written by `CheckpointWriter` and return the last state
+    or None if there is no complete checkpoint. Every line only holds the data and
+    prompts that were added since the line before, so they are concatenated. An
+    incomplete last line (for example, if the run was killed while writing) is
+    ignored.
+    """
+    if not os.path.exists(path):
+        return None
+    out_data = []
+    prompts = []
+    record = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                _record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            out_data += _record["out_data"]
+            prompts += _record["prompts"]
+            record = _record
+    if record is None:
+        return None
+    return LanguageCheckpoint(
+        out_data,
+        prompts,
+        record["shared_variables"],
+        record["datum_index"],
+        record["block"],
+        record["trial"],
+        record["history"],
+    )
+
+
+class CheckpointWriter:
+    """
+    Append the state of a language run to a JSON lines file after every `every`
+    timeline elements
+    """
+
+    def __init__(self, path, every=1, state=None):
+        self.path = path
+        _truncate_incomplete_line(path)
+        self.every = every
+        self._n_out_data = len(state.out_data) if state else 0
+        self._n_prompts = len(state.prompts) if state else 0
+        self._pending = 0
+
+    def write(self, state, force=False):
+        self._pending += 1
+        if self._pending < self.every and not force:
+            return
+        record = {
+            "out_data": state.out_data[self._n_out_data :],
+            "prompts": list(state.prompts[self._n_prompts :]),
+            "shared_variables": state.shared_variables,
+            "datum_index": state.datum_index,
+            "block": state.block,
+            "trial": state.trial,
+            "history": state.history,
+        }
+        line = check_serializable(
+            record,
+            "the data of the trials",
+            " The checkpoint file keeps the state before this trial.",
+        )
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self._n_out_data = len(state.out_data)
+        self._n_prompts = len(state.prompts)
+        self._pending = 0
+
+
+def check_serializable(value, name, note=""):
+    """
+    Return `value` as JSON or raise a TypeError if it can not be saved in a
+    checkpoint
+    """
+    try:
+        return json.dumps(value)
+    except (TypeError, ValueError) as e:
+        raise TypeError(
+            f"Checkpoints can only save JSON-serializable values, but {name} "
+            f"can not be serialized ({e}).{note}"
+        ) from e
+
+
+def _truncate_incomplete_line(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
@@ -0,0 +1,23 @@
+from typing import Iterable, TextIO
+
+
+def write_joined(out: TextIO, chunks: Iterable[str], separator: str = ","):
+    """
+    Write chunks of code to a text stream, separated like `separator.join(chunks)`.
+
+    Chunks can be produced lazily (for example, by a generator), so only one chunk
+    has to be held in memory at a time.
+
+    Examples:
+        >>> import io
+        >>> out = io.StringIO()
+        >>> write_joined(out, ["a", "b", "c"])
+        >>> out.getvalue()
+        'a,b,c'
+    """
+    first = True
+    for chunk in chunks:
+        if not first:
+            out.write(separator)
+        out.write(chunk)
+        first = False
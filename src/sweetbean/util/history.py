@@ -0,0 +1,232 @@
+import io
+from typing import Iterable, List, SupportsIndex
+
+
+class PromptHistory(List[str]):
+    """
+    The prompts of a participant in language mode
+
+    A list of prompts that also keeps the context that is passed to `get_input` in
+    single-turn mode (by default, all prompts joined with spaces). All prompts of the
+    context but the last are written to a buffer once, so appending a prompt does not
+    re-join the whole list. Stimuli only change the last prompt (for example, to add
+    the response), which keeps the buffer valid; changing earlier prompts rebuilds it.
+
+    The list always holds all prompts. Subclasses can limit the context to the last
+    prompts by moving its start (see `SlidingWindowHistory`).
+    """
+
+    def __init__(self, prompts=()):
+        super().__init__(prompts)
+        self._start = 0
+        self._reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_prefix", "_n_prefix", "_n_written", "_text"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _reset(self):
+        self._prefix = io.StringIO()
+        self._n_prefix = self._start
+        self._n_written = 0
+        self._text = None
+
+    def _write(self, part):
+        if self._n_written:
+            self._prefix.write(" ")
+        self._prefix.write(part)
+        self._n_written += 1
+
+    def _move_start(self):
+        pass
+
+    def _drop(self, start):
+        self._start = start
+        self._reset()
+
+    def start_block(self):
+        """
+        Called by the language runner before every block
+        """
+        pass
+
+    def get_state(self):
+        """
+        Return the state of the context (to save it in a checkpoint)
+        """
+        return {"start": self._start}
+
+    def set_state(self, state):
+        """
+        Restore the state of the context from `get_state` (after the prompts were
+        added)
+        """
+        self._start = state["start"]
+        self._reset()
+
+    def text(self):
+        """
+        Return the context (for the default history, like `" ".join(prompts)`)
+        """
+        if self._text is None:
+            self._move_start()
+            while self._n_prefix < len(self) - 1:
+                self._write(self[self._n_prefix])
+                self._n_prefix += 1
+            if self._n_prefix < len(self):
+                self._text = self[-1]
+                if self._n_written:
+                    self._text = f"{self._prefix.getvalue()} {self._text}"
+            else:
+                self._text = self._prefix.getvalue()
+        return self._text
+
+    def prefix(self):
+        """
+        Return the context without the last prompt. Until the start of the context
+        moves, every later context starts with it, so model servers with prefix
+        caching can reuse it.
+        """
+        self.text()
+        return self._prefix.getvalue()
+
+    def _changed(self):
+        # an earlier prompt may have changed, so the buffer is rebuilt
+        self._start = min(self._start, len(self))
+        self._reset()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice) or index % max(len(self), 1) < self._n_prefix:
+            self._reset()
+        self._text = None
+        super().__setitem__(index, value)
+
+    def append(self, prompt):
+        self._text = None
+        super().append(prompt)
+
+    def extend(self, prompts):
+        self._text = None
+        super().extend(prompts)
+
+    # same signature as `list.__iadd__`, which mypy still compares to the overloads
+    # of `list.__add__` for subclasses
+    def __iadd__(  # type: ignore[override,misc]
+        self, prompts: Iterable[str]
+    ) -> "PromptHistory":
+        self.extend(prompts)
+        return self
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._changed()
+
+    def __imul__(self, n: SupportsIndex) -> "PromptHistory":
+        super().__imul__(n)
+        self._changed()
+        return self
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def insert(self, index, prompt):
+        super().insert(index, prompt)
+        self._changed()
+
+    def pop(self, index=-1):
+        prompt = super().pop(index)
+        self._changed()
+        return prompt
+
+    def remove(self, prompt):
+        super().remove(prompt)
+        self._changed()
+
+    def reverse(self):
+        super().reverse()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._changed()
+
+
+class SlidingWindowHistory(PromptHistory):
+    """
+    A history whose context only holds the last `window` prompts
+
+    Old prompts are dropped `step` at a time, so the start of the context (and the
+    prefix that model servers can cache) stays the same for `step` prompts. With
+    `step=1`, the context always holds exactly the last `window` prompts.
+    """
+
+    def __init__(self, window, step=1, prompts=()):
+        if not 1 <= step <= window:
+            raise ValueError(f"step has to be between 1 and window ({window}).")
+        self.window = window
+        self.step = step
+        super().__init__(prompts)
+
+    def _move_start(self):
+        if len(self) - self._start > self.window:
+            self._drop(len(self) - self.window + self.step - 1)
+
+
+class SummaryHistory(SlidingWindowHistory):
+    """
+    A sliding window history that keeps a summary of the dropped prompts at the
+    start of the context
+
+    Arguments:
+        summarize: a function that gets the current summary and a list of the
+            dropped prompts and returns the new summary (for example, by prompting a
+            language model)
+        window: the maximum number of prompts after the summary
+        step: the number of prompts that are dropped (and summarized) at a time
+    """
+
+    def __init__(self, summarize, window, step=1, summary="", prompts=()):
+        self.summarize = summarize
+        self.summary = summary
+        super().__init__(window, step, prompts)
+
+    def _reset(self):
+        super()._reset()
+        if self.summary:
+            self._write(self.summary)
+
+    def _drop(self, start):
+        self.summary = self.summarize(self.summary, self[self._start : start])
+        super()._drop(start)
+
+    def get_state(self):
+        return {**super().get_state(), "summary": self.summary}
+
+    def set_state(self, state):
+        self.summary = state["summary"]
+        super().set_state(state)
+
+
+class BlockHistory(PromptHistory):
+    """
+    A history whose context only holds the prompts of the current block
+    """
+
+    def start_block(self):
+        self._drop(len(self))
+
+
+def join_prompts(prompts):
+    """
+    Join prompts with spaces, reusing the buffer of a `PromptHistory`
+    """
+    if isinstance(prompts, PromptHistory):
+        return prompts.text()
+    return " ".join(prompts)
@@ -1,16 +1,30 @@
 import ast
+import importlib.metadata
 import inspect
-import io
 import os
 import re
+import subprocess
 import sys
 import tempfile
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
-from transcrypt.__main__ import main as transcrypt_main
-
 from sweetbean.extension.TouchButton import TouchButton, _TouchButtonReplacer
+from sweetbean.util.cache import DiskCache, MemoryCache, cache_key
+
+# Compiled functions are cached on disk, keyed by the normalized source and the
+# Transcrypt version. Set `TRANSCRYPT_CACHE.enabled = False` (or the environment
+# variable SWEETBEAN_NO_CACHE) to always run the compiler.
+TRANSCRYPT_CACHE = DiskCache("transcrypt", max_size=32 * 1024 * 1024, suffix=".js")
+TRANSCRYPT_VERSION = importlib.metadata.version("Transcrypt")
+# increase when `_extract_arrow_function` or `_postprocess_functions` change the
+# code they produce, so outdated entries in `TRANSCRYPT_CACHE` are not used
+POSTPROCESS_VERSION = "1"
+
+# Translations are memoized per process, keyed by the function's code object and
+# source, so wrapping the same helper in many FunctionVariables compiles it once.
+FUNCTION_JS_CACHE = MemoryCache()
 
 
 def to_js(var):
@@ -287,6 +301,8 @@ def _fct_to_js(func):
     - Uses Transcrypt for general cases.
     - Emits a pure JS arrow for simple lambdas.
     - Rejects non-local captures (except allowed modules).
+    - Memoizes translations per process (see `FUNCTION_JS_CACHE`) and caches
+      compiled results on disk (see `TRANSCRYPT_CACHE`).
 
     Examples (ellipses keep lines short):
     >>> def add(a, b): return a + b
@@ -309,6 +325,18 @@ def _fct_to_js(func):
     '((v) => {...})'
 
 
+    """
+    key, source_code = _fct_cache_key(func)
+    js = FUNCTION_JS_CACHE.get(key)
+    if js is None:
+        js = _translate_fct(func, source_code)
+        FUNCTION_JS_CACHE.set(key, js)
+    return js
+
+
+def _fct_cache_key(func):
+    """
+    Check a function for non-local captures and return its cache key and source.
     """
     global_vars = func.__globals__
     code = func.__code__
@@ -330,9 +358,32 @@ def _fct_to_js(func):
             f"FunctionVariable args."
         )
 
-    # Prepare a self-contained Python module for Transcrypt
     try:
         source_code = inspect.getsource(func)
+    except Exception as e:
+        raise Exception(f"Error during conversion: {e}") from e
+
+    return (code, source_code, repr(func.__defaults__)), source_code
+
+
+def _translate_fct(func, source_code: str) -> str:
+    module_source, func_name, arrow = _prepare_fct_module(func, source_code)
+    if arrow is not None:
+        return arrow
+    return _compile_to_js(module_source, func_name)
+
+
+def _prepare_fct_module(
+    func, source_code: str
+) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Prepare a self-contained Python module for Transcrypt.
+
+    Returns the module source, the name of the function to extract from the
+    compiled module and, for simple lambdas, the finished arrow function (in which
+    case Transcrypt is not needed).
+    """
+    try:
         source_code = textwrap.dedent(source_code).strip()
         func_name_for_extract = None
 
@@ -342,7 +393,7 @@ def _fct_to_js(func):
 
             # 2) Try the fast path: emit pure JS arrow (no Transcrypt, no `l`)
             try:
-                return _emit_simple_lambda_arrow_from_node(lam_node)
+                return "", None, _emit_simple_lambda_arrow_from_node(lam_node)
             except Exception:
                 pass  # Not a simple expression → fall back
 
@@ -368,27 +419,140 @@ def _fct_to_js(func):
     except Exception as e:
         raise Exception(f"Error during conversion: {e}") from e
 
-    # Transcrypt pipeline (unchanged)
+    return source_code, func_name_for_extract, None
+
+
+def _transcrypt_cache_key(source_code: str, func_name: Optional[str]) -> str:
+    return cache_key(
+        TRANSCRYPT_VERSION, POSTPROCESS_VERSION, func_name or "", source_code
+    )
+
+
+def _compile_to_js(source_code: str, func_name: Optional[str]) -> str:
+    """
+    Compile a prepared Python module with Transcrypt and return the arrow function
+    for `func_name`. Results are served from `TRANSCRYPT_CACHE` when possible.
+    """
+    key = _transcrypt_cache_key(source_code, func_name)
+    cached = TRANSCRYPT_CACHE.get(key)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    full_js_code = _run_transcrypt(source_code)
+
+    # IMPORTANT: don’t strip "__lambda__" here
+    arrow = _extract_arrow_function(full_js_code, func_name)
+    # Optional postprocessing (your existing helper)
+    arrow = _postprocess_functions(arrow)
+    TRANSCRYPT_CACHE.set(key, arrow.encode("utf-8"))
+    return arrow
+
+
+def _compile_fcts(funcs, workers=None):
+    """
+    Translate several functions with as few Transcrypt runs as possible.
+
+    The functions are compiled in one combined module, or split into `workers`
+    modules that are compiled in parallel. The results are stored in
+    `FUNCTION_JS_CACHE` and `TRANSCRYPT_CACHE`, so later calls to `_fct_to_js` for
+    these functions do not start the compiler again. Functions that can not be
+    prepared, or a combined module that fails to compile, are skipped here; they
+    are compiled (and report their errors) one by one later.
+    """
+    pending: Dict[str, Tuple[str, Optional[str], list]] = {}
+    for func in funcs:
+        try:
+            key, source_code = _fct_cache_key(func)
+            if key in FUNCTION_JS_CACHE:
+                continue
+            module_source, func_name, arrow = _prepare_fct_module(func, source_code)
+        except Exception:
+            continue
+        if arrow is not None:
+            FUNCTION_JS_CACHE.set(key, arrow)
+            continue
+        disk_key = _transcrypt_cache_key(module_source, func_name)
+        cached = TRANSCRYPT_CACHE.get(disk_key)
+        if cached is not None:
+            FUNCTION_JS_CACHE.set(key, cached.decode("utf-8"))
+            continue
+        pending.setdefault(disk_key, (module_source, func_name, []))[2].append(key)
+    if not pending:
+        return
+
+    items = list(pending.items())
+    n_batches = max(1, min(workers or 1, len(items)))
+    batches = [items[idx::n_batches] for idx in range(n_batches)]
+    if n_batches == 1:
+        _compile_batch(batches[0])
+        return
+    with ThreadPoolExecutor(max_workers=n_batches) as executor:
+        list(executor.map(_compile_batch, batches))
+
+
+def _compile_batch(items):
+    modules = []
+    for idx, (_, (module_source, func_name, _)) in enumerate(items):
+        modules.append(
+            _rename_function(module_source, func_name, _batch_function_name(idx))
+        )
+    try:
+        full_js_code = _run_transcrypt("\n\n".join(modules))
+    except Exception:
+        return
+
+    for idx, (disk_key, (_, _, keys)) in enumerate(items):
+        try:
+            arrow = _extract_arrow_function(full_js_code, _batch_function_name(idx))
+        except RuntimeError:
+            continue
+        arrow = _postprocess_functions(arrow)
+        TRANSCRYPT_CACHE.set(disk_key, arrow.encode("utf-8"))
+        for key in keys:
+            FUNCTION_JS_CACHE.set(key, arrow)
+
+
+def _batch_function_name(idx: int) -> str:
+    return f"__sb_batch_{idx}__"
+
+
+def _rename_function(source_code: str, old_name: Optional[str], new_name: str) -> str:
+    """
+    Rename a top-level function in a module source. Names inside the function are
+    left alone: functions that refer to themselves are not compiled, so a name
+    equal to `old_name` in the body is a local (or nested def) that shadows it.
+    """
+    tree = ast.parse(source_code)
+    for stmt in tree.body:
+        if isinstance(stmt, ast.FunctionDef) and stmt.name == old_name:
+            stmt.name = new_name
+    return _unparse(tree)
+
+
+def _run_transcrypt(source_code: str) -> str:
+    """
+    Run Transcrypt on a module source and return the generated JavaScript.
+
+    The compiler runs in a child interpreter inside a temporary directory, so it
+    does not touch the working directory, `sys.argv` or `sys.stdout` of this
+    process and can be called from several threads at once.
+    """
     with tempfile.TemporaryDirectory() as temp_dir:
         temp_path = os.path.join(temp_dir, "temp_script.py")
         with open(temp_path, "w") as f:
             f.write(source_code)
 
-        old_cwd, old_argv = os.getcwd(), sys.argv[:]
-        output_buffer = io.StringIO()
-        try:
-            os.chdir(temp_dir)
-            sys.argv = [sys.argv[0], "-b", "temp_script.py"]
-            saved_stdout = sys.stdout
-            sys.stdout = output_buffer
-            exit_code = transcrypt_main()
-        finally:
-            sys.argv = old_argv
-            os.chdir(old_cwd)
-            sys.stdout = saved_stdout
+        result = subprocess.run(
+            [sys.executable, "-m", "transcrypt", "-b", "temp_script.py"],
+            cwd=temp_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        exit_code = result.returncode
 
         if exit_code != 0:
-            error_output = output_buffer.getvalue() or "No detailed error provided."
+            error_output = result.stdout or "No detailed error provided."
             raise RuntimeError(
                 f"Error occurred during execution. Return code: {exit_code}.\n"
                 f"Output: {error_output}."
@@ -401,10 +565,7 @@ def _fct_to_js(func):
         with open(js_output_path, "r") as f:
             full_js_code = f.read()
 
-    # IMPORTANT: don’t strip "__lambda__" here
-    arrow = _extract_arrow_function(full_js_code, func_name_for_extract)
-    # Optional postprocessing (your existing helper)
-    return _postprocess_functions(arrow)
+    return full_js_code
 
 
 def _extract_arrow_function(js_code: str, func_name: Optional[str] = None):
@@ -0,0 +1,142 @@
+import asyncio
+import io
+
+from PIL import Image
+from pyppeteer import launch
+from pyppeteer.errors import TimeoutError
+
+from sweetbean._const import IMAGE_READY_FLAG
+from sweetbean.util.cache import DiskCache, cache_key
+
+BROWSER_ARGS = ["--no-sandbox", "--disable-setuid-sandbox"]
+
+SCREENSHOT_CACHE = DiskCache("screenshots", max_size=512 * 1024 * 1024, suffix=".png")
+
+
+class HtmlRenderer:
+    """
+    A headless browser that renders HTML documents to images.
+
+    The browser is started once (when the first document that is not cached is
+    rendered) and its pages are reused for every render, so many stimuli can be
+    rendered without starting a new browser each time. The caller controls the
+    lifetime of the browser:
+
+        async with HtmlRenderer() as renderer:
+            image = await renderer.render(html)
+    """
+
+    def __init__(
+        self,
+        width=1920,
+        height=1080,
+        max_pages=1,
+        browser_args=None,
+        launch_options=None,
+        timeout=5,
+        cache=True,
+    ):
+        """
+        Arguments:
+            width: the width of the viewport in pixels
+            height: the height of the viewport in pixels
+            max_pages: the maximum number of pages that render at the same time
+            browser_args: the command line arguments of the browser
+            launch_options: further options for `pyppeteer.launch` (for example,
+                `executablePath`)
+            timeout: the maximum number of seconds to wait for a trial to signal
+                that it has been drawn before the screenshot is taken anyway
+            cache: if True, screenshots are stored on disk (keyed by the HTML
+                document and the viewport) and identical documents are not
+                rendered again. Documents that time out are not cached.
+        """
+        self.width = width
+        self.height = height
+        self.max_pages = max_pages
+        self.browser_args = BROWSER_ARGS if browser_args is None else browser_args
+        self.launch_options = launch_options or {}
+        self.timeout = timeout
+        self.cache = cache
+        self.browser = None
+        self._pages = None
+        self._page_count = 0
+        self._lock = None
+
+    async def start(self):
+        """
+        Launch the browser if it is not running yet
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.browser is None:
+                self.browser = await launch(
+                    headless=True, args=self.browser_args, **self.launch_options
+                )
+                self._pages = asyncio.Queue()
+                self._page_count = 0
+        return self
+
+    async def close(self):
+        """
+        Close the browser (called when leaving the context manager)
+        """
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+            self._pages = None
+        self._lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _acquire_page(self):
+        if self._pages.empty() and self._page_count < self.max_pages:
+            self._page_count += 1
+            page = await self.browser.newPage()
+            await page.setViewport({"width": self.width, "height": self.height})
+            return page
+        page = await self._pages.get()
+        # start from a fresh window so timers of the previous document do not
+        # interfere with the next one
+        await page.goto("about:blank")
+        return page
+
+    async def _wait_until_ready(self, page):
+        # trials rendered for images set this flag once they have been drawn
+        # (see `_BaseStimulus.to_js_for_image`), other documents time out
+        try:
+            await page.waitForFunction(
+                f"window.{IMAGE_READY_FLAG} === true",
+                {"timeout": self.timeout * 1000},
+            )
+        except TimeoutError:
+            return False
+        return True
+
+    async def render(self, html_content):
+        """
+        Render an HTML document and return the screenshot as a PIL image
+
+        Arguments:
+            html_content: the HTML document
+        """
+        key = cache_key(html_content, f"{self.width}x{self.height}")
+        screenshot_bytes = SCREENSHOT_CACHE.get(key) if self.cache else None
+        if screenshot_bytes is None:
+            await self.start()
+            page = await self._acquire_page()
+            try:
+                await page.setContent(html_content)
+                ready = await self._wait_until_ready(page)
+                screenshot_bytes = await page.screenshot({"fullPage": False})
+            finally:
+                self._pages.put_nowait(page)
+            # a document that timed out may not be drawn completely (for example,
+            # if a script failed to load), so it is rendered again next time
+            if self.cache and ready:
+                SCREENSHOT_CACHE.set(key, screenshot_bytes)
+        return Image.open(io.BytesIO(screenshot_bytes))
@@ -0,0 +1,41 @@
+from functools import lru_cache
+
+from jinja2 import BytecodeCache, Environment, FunctionLoader
+
+from sweetbean.util.cache import DiskCache
+
+
+class _DiskBytecodeCache(BytecodeCache):
+    """
+    Store the compiled templates in a `DiskCache`, so new processes (for example,
+    workers that simulate participants) skip parsing and code generation
+    """
+
+    def __init__(self):
+        self.cache = DiskCache("jinja", max_size=8 * 1024 * 1024, suffix=".jbc")
+
+    def load_bytecode(self, bucket):
+        value = self.cache.get(bucket.key)
+        if value is not None:
+            bucket.bytecode_from_string(value)
+
+    def dump_bytecode(self, bucket):
+        self.cache.set(bucket.key, bucket.bytecode_to_string())
+
+
+# the name of a template is its source, so templates defined as strings on the
+# stimulus classes can be loaded (and cached) like templates from files
+environment = Environment(
+    loader=FunctionLoader(lambda source: source),
+    bytecode_cache=_DiskBytecodeCache(),
+    auto_reload=False,
+)
+
+
+@lru_cache(maxsize=None)
+def get_template(source):
+    """
+    Return the compiled Jinja2 template for a source string. Every source is only
+    compiled once per process.
+    """
+    return environment.get_template(source)
@@ -1,6 +1,11 @@
 from abc import ABC, abstractmethod
 
-from sweetbean.util.parse import _fct_args_to_js, _fct_to_js, _var_to_js
+from sweetbean.util.parse import (
+    FUNCTION_JS_CACHE,
+    _fct_args_to_js,
+    _fct_to_js,
+    _var_to_js,
+)
 
 
 class Variable(ABC):
@@ -74,6 +79,20 @@ class FunctionVariable(Variable):
         fct_input = _fct_args_to_js(self.args)
         return f"({fct_declaration}){fct_input}"
 
+    @staticmethod
+    def cache_info():
+        """
+        Return the hits, misses and size of the in-process translation cache.
+        """
+        return FUNCTION_JS_CACHE.info()
+
+    @staticmethod
+    def cache_clear():
+        """
+        Clear the in-process translation cache and reset its counters.
+        """
+        FUNCTION_JS_CACHE.clear()
+
 
 class CodeVariable(Variable):
     """
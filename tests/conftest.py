@@ -0,0 +1,14 @@
+import pytest
+
+from sweetbean.util.cache import CACHE_DIR_ENV
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Keep the on-disk caches of every test in its own temporary directory instead
+    of the cache directory of the user
+    """
+    directory = tmp_path / "cache"
+    monkeypatch.setenv(CACHE_DIR_ENV, str(directory))
+    return directory
@@ -0,0 +1,58 @@
+import pytest
+
+from sweetbean import Block, Experiment
+from sweetbean.stimulus import Bandit, Text
+from sweetbean.util.bundle import asset_path, required_assets
+
+
+def _mirror(directory, types):
+    scripts, stylesheets = required_assets(types)
+    for asset in scripts + stylesheets:
+        path = asset_path(asset, str(directory))
+        (directory / path).parent.mkdir(parents=True, exist_ok=True)
+        if asset in scripts:
+            content = (
+                f"var {asset.package.split('/')[-1].replace('-', '_')}='</script>';\n"
+                "//# sourceMappingURL=index.browser.min.js.map\n"
+            )
+        else:
+            content = f"/* {asset.file} */\nbody {{\n  color: black;\n}}\n"
+        (directory / path).write_text(content)
+
+
+def test_bundle_inlines_used_plugins(tmp_path):
+    experiment = Experiment([Block([Text(text="A"), Text(text="B")])])
+    _mirror(tmp_path / "assets", ["jsPsychHtmlKeyboardResponse"])
+    experiment.to_html(tmp_path / "exp.html", bundle_dir=str(tmp_path / "assets"))
+    html = (tmp_path / "exp.html").read_text()
+
+    assert "unpkg.com" not in html and "<script src=" not in html
+    assert "var plugin_html_keyboard_response='<\\/script>';" in html
+    assert "var plugin_survey_text" not in html
+    assert "sourceMappingURL" not in html
+    assert html.count("<style>body{color: black;}</style>") == 2
+    assert "bandit" not in html
+    assert html.endswith("jsPsych.run(trials)</script>\n</html>")
+
+
+def test_bundle_missing_asset(tmp_path):
+    experiment = Experiment([Block([Bandit()])])
+    _mirror(tmp_path, ["jsPsychHtmlKeyboardResponse"])
+    with pytest.raises(FileNotFoundError, match="plugin-html-choice@1.0.0"):
+        experiment.to_html(tmp_path / "exp.html", bundle_dir=str(tmp_path))
+
+
+def test_preamble_loads_used_plugins(tmp_path):
+    experiment = Experiment([Block([Text(text="A")])])
+    experiment.to_html(tmp_path / "exp.html")
+    html = (tmp_path / "exp.html").read_text()
+    assert html.count("<script src=") == 3
+    assert "plugin-html-keyboard-response@1.1.2/dist/index.browser.min.js" in html
+    assert html.count('rel="stylesheet"') == 2
+
+    experiment = Experiment([Block([Text(text="A"), Bandit()])])
+    experiment.to_html(tmp_path / "exp.html", stream=True)
+    html = (tmp_path / "exp.html").read_text()
+    assert html.count("<script src=") == 4
+    assert "plugin-html-choice@1.0.0" in html
+    assert "dist/style/bandit.css" in html
@@ -0,0 +1,194 @@
+import os
+
+from sweetbean.util import parse
+from sweetbean.util.cache import DiskCache
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache("test", max_size=25, directory=str(tmp_path))
+    cache.set("a", b"0123456789")
+    cache.set("b", b"0123456789")
+    # make "a" older than "b", then read it so it becomes the most recent entry
+    os.utime(tmp_path / "a", (0, 0))
+    os.utime(tmp_path / "b", (1, 1))
+    assert cache.get("a") == b"0123456789"
+    cache.set("c", b"0123456789")
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_disk_cache_disabled(tmp_path):
+    cache = DiskCache("test", directory=str(tmp_path))
+    cache.enabled = False
+    cache.set("a", b"value")
+    assert cache.get("a") is None
+    assert not os.listdir(tmp_path)
+
+
+def test_transcrypt_output_is_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        parse, "TRANSCRYPT_CACHE", DiskCache("transcrypt", directory=str(tmp_path))
+    )
+
+    def add(a, b):
+        for _ in range(3):
+            a += b
+        return a + b
+
+    js = parse._fct_to_js(add)
+    assert len(os.listdir(tmp_path)) == 1
+
+    def _fail(_source_code):
+        raise AssertionError("Transcrypt should not run on a cache hit")
+
+    # clear the in-process cache, so the second call has to read the disk cache
+    parse.FUNCTION_JS_CACHE.clear()
+    monkeypatch.setattr(parse, "_run_transcrypt", _fail)
+    assert parse._fct_to_js(add) == js
+
+
+def test_function_translation_is_memoized(monkeypatch):
+    from sweetbean.stimulus import Text
+    from sweetbean.variable import FunctionVariable
+
+    FunctionVariable.cache_clear()
+    calls = []
+    translate = parse._translate_fct
+
+    def _counting_translate(func, source_code):
+        calls.append(func)
+        return translate(func, source_code)
+
+    monkeypatch.setattr(parse, "_translate_fct", _counting_translate)
+    for text in ["A", "B", "C"]:
+        Text(text=text).to_js()
+
+    info = FunctionVariable.cache_info()
+    assert len(calls) == 1
+    assert info.misses == 1
+    assert info.hits == 5
+
+
+def test_experiment_compiles_functions_in_one_run(tmp_path, monkeypatch):
+    from sweetbean import Block, Experiment
+    from sweetbean.stimulus import Flanker, Text, TextSurvey
+
+    monkeypatch.setattr(
+        parse, "TRANSCRYPT_CACHE", DiskCache("transcrypt", directory=str(tmp_path))
+    )
+    parse.FUNCTION_JS_CACHE.clear()
+    runs = []
+    run_transcrypt = parse._run_transcrypt
+
+    def _counting_run(source_code):
+        runs.append(source_code)
+        return run_transcrypt(source_code)
+
+    monkeypatch.setattr(parse, "_run_transcrypt", _counting_run)
+    stimuli = [Text(text="A"), Flanker(), TextSurvey(["Q"])]
+    Experiment([Block(stimuli)]).to_js()
+    assert len(runs) == 1
+
+    # compiling each function on its own produces the same code (up to the
+    # positions where the minifier wraps lines)
+    batched = [s.js.replace("\n", "") for s in stimuli]
+    monkeypatch.setattr(
+        parse,
+        "TRANSCRYPT_CACHE",
+        DiskCache("transcrypt", directory=str(tmp_path / "single")),
+    )
+    parse.FUNCTION_JS_CACHE.clear()
+    for s in stimuli:
+        s.to_js()
+    assert [s.js.replace("\n", "") for s in stimuli] == batched
+    assert len(runs) == 4
+
+
+def test_parallel_compilation_matches_serial(tmp_path, monkeypatch):
+    from sweetbean import Block, Experiment
+    from sweetbean.stimulus import Bandit, Flanker, LikertSurvey, Text
+
+    def _to_js(workers, directory):
+        monkeypatch.setattr(
+            parse, "TRANSCRYPT_CACHE", DiskCache("transcrypt", directory=directory)
+        )
+        parse.FUNCTION_JS_CACHE.clear()
+        stimuli = [Text(text="A"), Flanker(), Bandit(), LikertSurvey()]
+        experiment = Experiment([Block(stimuli)])
+        experiment.to_js(workers=workers)
+        return experiment.js.replace("\n", ""), len(os.listdir(directory))
+
+    serial = _to_js(None, str(tmp_path / "serial"))
+    parallel = _to_js(3, str(tmp_path / "parallel"))
+    assert parallel == serial
+
+
+def _shadowing(x):
+    def _shadowing(y):
+        return y + 1
+
+    return _shadowing(x)
+
+
+def test_batch_rename_keeps_shadowing_names():
+    import ast
+
+    source = parse._rename_function(
+        "def g(x):\n    def g(y):\n        return y + 1\n    g = g\n    return g(x)\n",
+        "g",
+        "__sb_batch_0__",
+    )
+    tree = ast.parse(source)
+    assert tree.body[0].name == "__sb_batch_0__"
+    assert "__sb_batch_0__" not in ast.unparse(tree.body[0].body)
+    assert "return g(x)" in source
+
+
+def test_batch_compiles_shadowing_function_like_single(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        parse, "TRANSCRYPT_CACHE", DiskCache("transcrypt", directory=str(tmp_path))
+    )
+    parse.FUNCTION_JS_CACHE.clear()
+    parse._compile_fcts([_shadowing, lambda a: a * 2])
+    batched = parse._fct_to_js(_shadowing)
+    assert "__sb_batch_" not in batched
+
+    monkeypatch.setattr(
+        parse,
+        "TRANSCRYPT_CACHE",
+        DiskCache("transcrypt", directory=str(tmp_path / "single")),
+    )
+    parse.FUNCTION_JS_CACHE.clear()
+    assert parse._fct_to_js(_shadowing).replace("\n", "") == batched.replace("\n", "")
+
+
+def test_disk_cache_tracks_size_without_listing(tmp_path, monkeypatch):
+    cache = DiskCache("test", max_size=100, directory=str(tmp_path))
+    cache.set("a", b"0123456789")
+    listings = []
+    entries = DiskCache._entries
+
+    def _counting_entries(self):
+        if self is cache:
+            listings.append(self)
+        return entries(self)
+
+    monkeypatch.setattr(DiskCache, "_entries", _counting_entries)
+    cache.set("b", b"01234")
+    cache.set("c", b"01234")
+    assert not listings
+    assert cache._size == 20
+
+    # entries written by another process are counted once 20% of the maximum
+    # size was written, and the oldest entries are evicted down to 80% of it
+    other = DiskCache("test", max_size=100, directory=str(tmp_path))
+    for key in "defghij":
+        other.set(key, b"0123456789")
+    for idx, key in enumerate("abcdefghij"):
+        os.utime(tmp_path / key, (idx, idx))
+    cache.set("k", b"012345678901234")
+    assert listings
+    assert sorted(os.listdir(tmp_path)) == list("efghijk")
+    assert cache._size == 75
@@ -0,0 +1,113 @@
+import gzip
+import io
+import json
+
+from sweetbean import Block, Experiment
+from sweetbean.stimulus import Feedback, Fixation, Text
+from sweetbean.variable import TimelineVariable
+
+
+def _experiment():
+    timeline = [
+        {"word": "RED", "color": "red", "key": "f"},
+        {"word": "GREEN", "color": "green", "key": "j"},
+    ]
+    text = Text(
+        duration=1000,
+        text=TimelineVariable("word"),
+        color=TimelineVariable("color"),
+        choices=["f", "j"],
+        correct_key=TimelineVariable("key"),
+    )
+    instructions = Block([Text(text="Welcome", choices=[" "])])
+    trials = Block([Fixation(500), text, Feedback(300)], timeline)
+    return Experiment([instructions, trials])
+
+
+def test_streamed_html_matches_html(tmp_path):
+    experiment = _experiment()
+    experiment.to_html(tmp_path / "full.html")
+    experiment.to_html(tmp_path / "streamed.html", stream=True)
+    assert (tmp_path / "full.html").read_text() == (
+        tmp_path / "streamed.html"
+    ).read_text()
+
+    out = io.StringIO()
+    experiment.write_js(out, path_local_download="data.csv")
+    experiment.to_js(path_local_download="data.csv")
+    assert out.getvalue() == experiment.js
+
+
+def test_deduplicate_shares_repeated_stimuli():
+    fixation = Fixation(500)
+    feedback = Feedback(300)
+    blocks = [Block([fixation, Text(text=word), feedback]) for word in ["A", "B", "C"]]
+    experiment = Experiment(blocks)
+    experiment.to_js()
+    full = experiment.js
+    experiment.to_js(deduplicate=True)
+    assert len(experiment.js) < len(full)
+
+    fixation.to_js()
+    feedback.to_js()
+    assert full.count(fixation.js) == 3
+    assert experiment.js.count(fixation.js) == 1
+    assert experiment.js.count(feedback.js) == 1
+    assert experiment.js.count("const __sb_stimulus_") == 2
+
+    out = io.StringIO()
+    experiment.write_js(out, deduplicate=True)
+    assert out.getvalue() == experiment.js
+
+
+def test_columnar_timeline():
+    timeline = [{"word": w, "n": i, "ok": i % 2 == 0} for i, w in enumerate("abc")]
+    text = Text(text=TimelineVariable("word"))
+    rows = Block([text], timeline)
+    columns = Block([text], timeline, columnar_timeline=True)
+    rows.to_js()
+    columns.to_js()
+    assert "[{'word': 'a', 'n': 0, 'ok': True}" in rows.js
+    assert (
+        'sweetbeanTimelineColumns({"word":["a","b","c"],"n":[0,1,2],'
+        '"ok":[true,false,true]})' in columns.js
+    )
+
+    experiment = Experiment([columns])
+    experiment.to_js()
+    assert "function sweetbeanTimelineColumns" in experiment.js
+    experiment = Experiment([rows])
+    experiment.to_js()
+    assert "function sweetbeanTimelineColumns" not in experiment.js
+
+    # rows with different keys fall back to one object per row
+    ragged = Block([text], [{"word": "a"}, {"word": "b", "n": 1}], True)
+    ragged.to_js()
+    assert "[{'word': 'a'}, {'word': 'b', 'n': 1}]" in ragged.js
+
+
+def test_timeline_files(tmp_path):
+    experiment = _experiment()
+    experiment.to_html(tmp_path / "inline.html")
+    experiment.to_html(tmp_path / "exp.html", timeline_files="json")
+    assert json.loads((tmp_path / "exp_block1.json").read_text()) == (
+        experiment.blocks[1].timeline
+    )
+    assert not (tmp_path / "exp_block0.json").exists()
+    html = (tmp_path / "exp.html").read_text()
+    assert "'word': 'RED'" in (tmp_path / "inline.html").read_text()
+    assert "'word': 'RED'" not in html
+    assert 'sweetbeanFetchTimeline("exp_block1.json")' in html
+    assert "timeline_variables: sweetbeanTimeline1}" in html
+
+    experiment.blocks[1].columnar_timeline = True
+    experiment.to_html(tmp_path / "exp.html", timeline_files="gzip", stream=True)
+    with gzip.open(tmp_path / "exp_block1.json.gz", "rt") as f:
+        assert json.load(f)["word"] == ["RED", "GREEN"]
+    html = (tmp_path / "exp.html").read_text()
+    assert "sweetbeanTimelineColumns(sweetbeanTimeline1)" in html
+
+    js = experiment.to_js_string(timeline_urls={1: "https://example.com/t.json"})
+    assert (
+        'await Promise.all([sweetbeanFetchTimeline("https://example.com/t.json")' in js
+    )
@@ -0,0 +1,386 @@
+import asyncio
+import copy
+import threading
+import time
+
+import pytest
+from jinja2 import Template
+
+from sweetbean import Block, Experiment
+from sweetbean.llm_utils.cache import ResponseCache
+from sweetbean.llm_utils.prompts import demographic
+from sweetbean.stimulus import Bandit, MultiChoiceSurvey, Text, TextSurvey
+from sweetbean.util.history import (
+    BlockHistory,
+    PromptHistory,
+    SlidingWindowHistory,
+    SummaryHistory,
+)
+from sweetbean.util.templates import get_template
+from sweetbean.variable import TimelineVariable
+
+
+def _experiment():
+    timeline = [{"word": "RED"}, {"word": "GREEN"}]
+    text = Text(text=TimelineVariable("word"), choices=["f", "j"])
+    survey = TextSurvey(["How old are you?"])
+    return Experiment([Block([text], timeline), Block([survey])])
+
+
+def _respond(prompt):
+    return "f" if prompt.count("<<") % 2 else "j"
+
+
+def test_run_on_language_many_matches_single_runs():
+    experiment = _experiment()
+    expected = experiment.run_on_language(_respond, preamble="A")
+    active = []
+    max_active = []
+    preambles = set()
+
+    def _slow_respond(prompt):
+        preambles.add(prompt[0])
+        active.append(threading.get_ident())
+        max_active.append(len(active))
+        time.sleep(0.02)
+        active.pop()
+        return _respond(prompt)
+
+    results = experiment.run_on_language_many(
+        4, _slow_respond, preamble=["A", "B", "C", "D"], max_concurrency=4
+    )
+    assert results[0] == expected
+    assert all(r[0] == expected[0] for r in results)
+    assert preambles == {"A", "B", "C", "D"}
+    assert max(max_active) > 1
+
+
+def test_run_on_language_many_async_get_input():
+    experiment = _experiment()
+    expected = experiment.run_on_language(_respond)
+
+    async def _respond_async(prompt):
+        await asyncio.sleep(0.01)
+        return _respond(prompt)
+
+    results = experiment.run_on_language_many(3, _respond_async, max_concurrency=2)
+    assert results == [expected] * 3
+
+
+def _bandit_experiment():
+    bandit = Bandit(
+        bandits=[{"color": "red", "value": 1}, {"color": "green", "value": 0}]
+    )
+    survey = MultiChoiceSurvey([{"prompt": "Did you like it?", "options": ["y", "n"]}])
+    return Experiment([Block([bandit], [{}, {}]), Block([survey])])
+
+
+def _respond_bandit(prompt):
+    return "y" if prompt.endswith("n<<") else "1"
+
+
+def test_arun_on_language_matches_run_on_language():
+    expected = _bandit_experiment().run_on_language(_respond_bandit, preamble="P")
+
+    async def _respond_async(prompt):
+        await asyncio.sleep(0)
+        return _respond_bandit(prompt)
+
+    result = asyncio.run(
+        _bandit_experiment().arun_on_language(_respond_async, preamble="P")
+    )
+    assert result == expected
+    assert result[0][0]["value"] == 1
+    assert result[0][-1]["response"] == {"Q0": "y"}
+
+
+def test_arun_on_language_does_not_block_event_loop():
+    ticks = []
+
+    async def _tick():
+        for _ in range(5):
+            ticks.append(len(ticks))
+            await asyncio.sleep(0)
+
+    async def _respond_async(prompt):
+        await asyncio.sleep(0)
+        return _respond(prompt)
+
+    async def _main():
+        return await asyncio.gather(
+            _experiment().arun_on_language(_respond_async), _tick()
+        )
+
+    result, _ = asyncio.run(_main())
+    assert result == _experiment().run_on_language(_respond)
+    assert len(ticks) == 5
+
+
+def test_run_on_language_batch_matches_single_runs():
+    experiment = _experiment()
+    replayed, _ = experiment.run_on_language(_respond)
+    batches = []
+
+    def _respond_batch(prompts):
+        batches.append(len(prompts))
+        return [_respond(p) for p in prompts]
+
+    results = experiment.run_on_language_batch(
+        3, _respond_batch, preamble=["A", "B", "C"], data=[None, replayed, None]
+    )
+    assert results[0] == experiment.run_on_language(_respond, preamble="A")
+    assert results[2] == experiment.run_on_language(_respond, preamble="C")
+    assert results[1][0] == replayed
+    assert batches == [2, 2, 2]
+
+
+def test_prompt_history_joins_like_list():
+    history = PromptHistory()
+    expected = []
+    assert history.text() == ""
+    for idx in range(5):
+        for prompts in (history, expected):
+            prompts.append(f"trial {idx}")
+            prompts[-1] += " <<f>>"
+        assert history.text() == " ".join(expected)
+    history += ["a", "b"]
+    expected += ["a", "b"]
+    assert history.text() == " ".join(expected)
+    history[1] = expected[1] = "changed"
+    assert history.text() == " ".join(expected)
+    history.pop(0)
+    expected.pop(0)
+    assert history.text() == " ".join(expected)
+    assert copy.deepcopy(history).text() == " ".join(expected)
+    assert history == expected
+    for mutate in (
+        lambda p: p.insert(1, "inserted"),
+        lambda p: p.remove("inserted"),
+        lambda p: p.__delitem__(0),
+        lambda p: p.reverse(),
+        lambda p: p.sort(),
+        lambda p: p.__imul__(2),
+        lambda p: p.clear(),
+    ):
+        history.text()
+        mutate(history)
+        mutate(expected)
+        assert history.text() == " ".join(expected)
+
+
+def _words_experiment(n_trials=6):
+    timeline = [{"word": f"W{idx}"} for idx in range(n_trials)]
+    text = Text(text=TimelineVariable("word"), choices=["f", "j"])
+    return Experiment([Block([text], timeline), Block([text], timeline[:2])])
+
+
+def test_sliding_window_history_keeps_prefix_between_drops():
+    contexts = []
+    prefixes = []
+    histories = []
+
+    def _history():
+        histories.append(SlidingWindowHistory(3, step=2))
+        return histories[-1]
+
+    def _respond_window(prompt):
+        contexts.append(prompt)
+        prefixes.append(histories[-1].prefix())
+        return "f"
+
+    experiment = _words_experiment()
+    _, prompts = experiment.run_on_language(_respond_window, history=_history)
+    assert prompts == experiment.run_on_language(lambda p: "f")[1]
+    assert [c.count("<<") for c in contexts] == [1, 2, 3, 2, 3, 2, 3, 2]
+    assert contexts[-1] == " ".join(prompts[-2:])[:-3]
+    assert prefixes[3] == prompts[2]
+    assert prefixes[4].startswith(prefixes[3])
+
+
+def test_summary_history_summarizes_dropped_prompts():
+    contexts = []
+
+    def _summarize(summary, dropped):
+        return f"{summary}[{len(dropped)}]"
+
+    experiment = _words_experiment(4)
+    _, prompts = experiment.run_on_language(
+        lambda p: contexts.append(p) or "f",
+        history=lambda: SummaryHistory(_summarize, 2),
+    )
+    assert len(prompts) == 6
+    assert contexts[-1].startswith("[1][1][1][1] ")
+    assert contexts[-1].count("<<") == 2
+
+
+def test_block_history_resets_context():
+    contexts = []
+    experiment = _words_experiment(3)
+    experiment.run_on_language(
+        lambda p: contexts.append(p) or "f", history=BlockHistory
+    )
+    assert [c.count("<<") for c in contexts] == [1, 2, 3, 1, 2]
+
+
+def test_templates_are_compiled_once():
+    text = Text(text="RED", color="red", choices=["f", "j"])
+    text._prepare_args_l({}, [], {})
+    assert get_template(text.l_template) is get_template(Text.l_template)
+    assert text._get_prompt_l() == Template(text.l_template).render(text.l_args)
+    assert demographic(52, "woman") == "You are a 52-year-old woman."
+
+
+def test_run_on_language_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    experiment = _words_experiment(4)
+    expected = experiment.run_on_language(_respond, history=BlockHistory)
+    calls = []
+
+    def _failing_respond(prompt):
+        if len(calls) == 5:
+            raise RuntimeError("connection lost")
+        calls.append(prompt)
+        return _respond(prompt)
+
+    with pytest.raises(RuntimeError):
+        experiment.run_on_language(
+            _failing_respond, history=BlockHistory, checkpoint=path
+        )
+    with open(path, "a") as f:
+        f.write('{"out_data": [')
+
+    contexts = []
+    result = experiment.run_on_language(
+        lambda p: contexts.append(p) or _respond(p),
+        history=BlockHistory,
+        checkpoint=path,
+    )
+    assert result == expected
+    assert contexts[0].count("<<") == 2
+    assert len(contexts) == 1
+
+    assert experiment.run_on_language(None, checkpoint=path) == expected
+
+
+def test_response_cache_skips_cached_prompts(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    experiment = _experiment()
+    calls = []
+
+    def _counting_respond(prompt):
+        calls.append(prompt)
+        return _respond(prompt)
+
+    with ResponseCache(path, model="m", temperature=0) as cache:
+        expected = experiment.run_on_language(cache.wrap(_counting_respond))
+        assert cache.info() == (0, 3, 3)
+    with ResponseCache(path, model="m", temperature=0) as cache:
+        assert experiment.run_on_language(cache.wrap(_counting_respond)) == expected
+        assert cache.info() == (3, 0, 3)
+        results = experiment.run_on_language_batch(
+            2,
+            cache.wrap_batch(lambda prompts: [_respond(p) for p in prompts]),
+            preamble=["", "X"],
+        )
+        assert results[0] == expected
+        assert cache.info() == (6, 3, 6)
+    with ResponseCache(path, model="m", temperature=1) as cache:
+        experiment.run_on_language(cache.wrap(_counting_respond))
+        assert cache.info().misses == 3
+    assert len(calls) == 6
+
+
+class _CustomText(Text):
+    def process_l(self, prompts, get_input, multi_turn, datum=None):
+        response = get_input("CUSTOM")
+        prompts.append(f"CUSTOM<<{response}>>")
+        data = self.l_args.copy()
+        data.update({"response": response})
+        return data, prompts
+
+
+def test_overridden_process_l_is_used():
+    experiment = Experiment([Block([_CustomText(text="RED"), Text(text="GREEN")])])
+    seen = []
+
+    def _respond_custom(prompt):
+        seen.append(prompt)
+        return "f"
+
+    out_data, prompts = experiment.run_on_language(_respond_custom, preamble="P")
+    assert seen == ["P CUSTOM"]
+    assert prompts[0] == "CUSTOM<<f>>"
+    assert out_data[0]["response"] == "f"
+
+    async def _respond_async(prompt):
+        await asyncio.sleep(0)
+        return "f"
+
+    assert asyncio.run(experiment.arun_on_language(_respond_async, preamble="P")) == (
+        out_data,
+        prompts,
+    )
+    results = experiment.run_on_language_batch(
+        2, lambda batch: ["f"] * len(batch), preamble="P"
+    )
+    assert results == [(out_data, prompts)] * 2
+
+
+def test_overridden_process_l_errors_are_raised():
+    experiment = Experiment([Block([_CustomText(text="RED")])])
+
+    def _failing_respond(prompt):
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        experiment.run_on_language(_failing_respond)
+
+
+@pytest.mark.parametrize(
+    "history",
+    [
+        PromptHistory,
+        BlockHistory,
+        lambda: SlidingWindowHistory(3, step=2),
+        lambda: SummaryHistory(lambda s, d: f"{s}[{len(d)}]", 2),
+    ],
+)
+@pytest.mark.parametrize("n_calls", [1, 3, 5, 7])
+def test_resumed_run_sends_same_contexts(tmp_path, history, n_calls):
+    path = str(tmp_path / "run.jsonl")
+    experiment = _words_experiment(6)
+    expected_contexts = []
+    expected = experiment.run_on_language(
+        lambda p: expected_contexts.append(p) or _respond(p), history=history
+    )
+
+    calls = []
+
+    def _failing_respond(prompt):
+        if len(calls) == n_calls:
+            raise RuntimeError("connection lost")
+        calls.append(prompt)
+        return _respond(prompt)
+
+    with pytest.raises(RuntimeError):
+        experiment.run_on_language(_failing_respond, history=history, checkpoint=path)
+    contexts = []
+    result = experiment.run_on_language(
+        lambda p: contexts.append(p) or _respond(p), history=history, checkpoint=path
+    )
+    assert result == expected
+    assert calls + contexts == expected_contexts
+
+
+def test_checkpoint_rejects_data_that_can_not_be_saved(tmp_path):
+    experiment = Experiment([Block([Text(text="A")], [{"word": object()}])])
+    with pytest.raises(TypeError, match="timeline of block 0"):
+        experiment.run_on_language(checkpoint=str(tmp_path / "a.jsonl"))
+
+    path = tmp_path / "b.jsonl"
+    experiment = _bandit_experiment()
+    with pytest.raises(TypeError, match="data of the trials"):
+        experiment.run_on_language(
+            lambda p: {"response": "1", "raw": object()}, checkpoint=str(path)
+        )
+    assert not path.exists()
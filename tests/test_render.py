@@ -0,0 +1,226 @@
+import asyncio
+import io
+import re
+import shutil
+
+import pytest
+from PIL import Image
+
+from sweetbean import Block
+from sweetbean.block import create_stimulus_sequence, save_animation
+from sweetbean.stimulus import Text
+from sweetbean.util import render
+from sweetbean.util.cache import DiskCache
+from sweetbean.util.render import HtmlRenderer
+from sweetbean.variable import TimelineVariable
+
+
+class FakePage:
+    def __init__(self, browser):
+        self.browser = browser
+
+    async def setViewport(self, viewport):
+        self.viewport = viewport
+
+    async def goto(self, url):
+        pass
+
+    async def setContent(self, html):
+        self.browser.rendered.append(html)
+        self.html = html
+        self.browser.active += 1
+        self.browser.max_active = max(self.browser.max_active, self.browser.active)
+        # finish in a different order than started
+        await asyncio.sleep(0.01 * (len(self.browser.rendered) % 3))
+        self.browser.active -= 1
+
+    async def waitForFunction(self, expression, options):
+        assert expression == "window.__sweetbeanReady === true"
+        if "__sweetbeanReady=true" not in self.html:
+            raise render.TimeoutError()
+
+    async def screenshot(self, options):
+        out = io.BytesIO()
+        # the color of the screenshot identifies the trial
+        trial = re.search(r"text:\(\)=>\{let text='(\w)'", self.html)
+        color = (ord(trial[1]) if trial else 0, 0, 0)
+        size = (self.viewport["width"], self.viewport["height"])
+        Image.new("RGB", size, color).save(out, "PNG")
+        return out.getvalue()
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.pages = []
+        self.rendered = []
+        self.closed = False
+        self.active = 0
+        self.max_active = 0
+
+    async def newPage(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    async def close(self):
+        self.closed = True
+
+
+def _fake_browser(monkeypatch, tmp_path):
+    browsers = []
+    monkeypatch.setattr(
+        render,
+        "SCREENSHOT_CACHE",
+        DiskCache("screenshots", directory=str(tmp_path / "cache")),
+    )
+
+    async def _launch(**kwargs):
+        browsers.append(FakeBrowser())
+        return browsers[-1]
+
+    monkeypatch.setattr(render, "launch", _launch)
+    return browsers
+
+
+def test_to_image_uses_one_browser(monkeypatch, tmp_path):
+    browsers = _fake_browser(monkeypatch, tmp_path)
+    block = Block([Text(duration=500, text="A"), Text(duration=800, text="B")])
+    images, durations = block.to_image(None, None, sequence=False)
+    assert durations == [500, 800]
+    assert [i.size for i in images] == [(1920, 1080)] * 2
+    assert len(browsers) == 1
+    assert len(browsers[0].pages) == 1
+    assert len(browsers[0].rendered) == 2
+    assert browsers[0].closed
+
+
+def test_renderer_is_shared(monkeypatch, tmp_path):
+    browsers = _fake_browser(monkeypatch, tmp_path)
+    blocks = [Block([Text(duration=500, text="A")]), Block([Text(text="B")])]
+
+    async def _render():
+        async with HtmlRenderer(width=640, height=480) as renderer:
+            return [
+                await b.to_image_async(None, None, sequence=False, renderer=renderer)
+                for b in blocks
+            ]
+
+    results = asyncio.run(_render())
+    assert [r[0][0].size for r in results] == [(640, 480)] * 2
+    assert len(browsers) == 1
+    assert browsers[0].closed
+
+
+def test_renderer_falls_back_to_timeout(monkeypatch, tmp_path):
+    browsers = _fake_browser(monkeypatch, tmp_path)
+
+    async def _render():
+        async with HtmlRenderer(timeout=0.1) as renderer:
+            return await renderer.render("<html></html>")
+
+    assert asyncio.run(_render()).size == (1920, 1080)
+    # the screenshot of a document that timed out is not cached
+    asyncio.run(_render())
+    assert len(browsers) == 2
+    assert len(browsers[1].rendered) == 1
+
+
+def test_concurrent_rendering_keeps_order(monkeypatch, tmp_path):
+    browsers = _fake_browser(monkeypatch, tmp_path)
+    timeline = [{"word": w} for w in "abcdefg"]
+    block = Block(
+        [
+            Text(duration=100, text=TimelineVariable("word")),
+            Text(duration=200, text="x"),
+        ],
+        timeline,
+    )
+    images, durations = block.to_image(
+        None, None, sequence=False, timeline_idx=None, concurrency=3
+    )
+    assert [chr(i.getpixel((0, 0))[0]) for i in images] == [
+        c for w in "abcdefg" for c in (w, "x")
+    ]
+    assert durations == [100, 200] * 7
+    assert len(browsers[0].pages) == 3
+    assert browsers[0].max_active == 3
+
+    async def _render():
+        async with HtmlRenderer(max_pages=3, cache=False) as renderer:
+            await block.to_image_async(
+                str(tmp_path / "images"),
+                None,
+                sequence=False,
+                timeline_idx=None,
+                renderer=renderer,
+                concurrency=3,
+            )
+
+    (tmp_path / "images").mkdir()
+    asyncio.run(_render())
+    assert len(list((tmp_path / "images").iterdir())) == 14
+    assert len(browsers) == 2
+    assert browsers[1].closed
+    assert Image.open(tmp_path / "images" / "stimulus_4.png").getpixel((0, 0))[
+        0
+    ] == ord("c")
+
+
+def test_screenshots_are_cached(monkeypatch, tmp_path):
+    browsers = _fake_browser(monkeypatch, tmp_path)
+    block = Block([Text(duration=500, text="a"), Text(duration=800, text="b")])
+    first, _ = block.to_image(None, None, sequence=False)
+    second, _ = block.to_image(None, None, sequence=False)
+    assert len(browsers) == 1
+    assert len(browsers[0].rendered) == 2
+    assert [i.getpixel((0, 0)) for i in second] == [i.getpixel((0, 0)) for i in first]
+
+    # a different viewport is rendered again
+    async def _render():
+        async with HtmlRenderer(width=640, height=480) as renderer:
+            await block.to_image_async(None, None, sequence=False, renderer=renderer)
+
+    asyncio.run(_render())
+    assert len(browsers) == 2
+
+
+def test_stimulus_sequence_max_size():
+    # a tenth of full HD keeps the full-size sequence small
+    images = [Image.new("RGB", (192, 108), (i * 10, 0, 0)) for i in range(20)]
+    full = create_stimulus_sequence(images, [100] * 20)
+    small = create_stimulus_sequence(iter(images), [100] * 20, max_size=2000)
+    assert full.size == (3753, 1215)
+    assert 1950 < max(small.size) <= 2000
+    with pytest.raises(ValueError):
+        create_stimulus_sequence(iter(images), [100] * 19)
+
+
+@pytest.mark.parametrize("extension", [".webp", ".gif"])
+def test_animation_uses_durations(monkeypatch, tmp_path, extension):
+    _fake_browser(monkeypatch, tmp_path)
+    block = Block([Text(duration=500, text="a"), Text(text="z")])
+    path = tmp_path / f"block{extension}"
+    block.to_animation(str(path), max_size=480, response_duration=2000)
+    with Image.open(path) as animation:
+        assert animation.n_frames == 2
+        assert max(animation.size) == 480
+        frames = []
+        for idx in range(animation.n_frames):
+            animation.seek(idx)
+            animation.load()
+            frames.append(animation.info["duration"])
+    assert frames == [500, 2000]
+
+
+@pytest.mark.parametrize("extension", [".webp", ".gif", ".mp4"])
+def test_animation_without_frames(tmp_path, extension):
+    with pytest.raises(ValueError, match="at least one frame"):
+        save_animation([], [], str(tmp_path / f"empty{extension}"))
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="Requires ffmpeg")
+def test_animation_mp4(monkeypatch, tmp_path):
+    _fake_browser(monkeypatch, tmp_path)
+    block = Block([Text(duration=500, text="a"), Text(duration=500, text="b")])
+    block.to_animation(str(tmp_path / "block.mp4"), max_size=480)
+    assert (tmp_path / "block.mp4").stat().st_size > 0